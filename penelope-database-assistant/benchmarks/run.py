@@ -0,0 +1,421 @@
+"""
+Offline microbenchmarks for Penelope's hot paths, run against the payloads in benchmarks/fixtures.
+
+Usage:
+    python benchmarks/run.py                   # run every benchmark
+    python benchmarks/run.py --only llama_chains_lookup history_round_trip
+    python benchmarks/run.py --save-baseline   # store the results in benchmarks/baseline.json
+    python benchmarks/run.py --compare         # fail if ops/s dropped more than --tolerance
+
+History benchmarks use an in-memory SQLite stand-in for the chat history table unless
+BENCH_POSTGRES_URL points at a local Postgres, the write-behind one needs Postgres. Model
+benchmarks are skipped when the model weights are not available locally. Tool selection
+benchmarks use a fake LLM, they only time the prompt and the runnable graph.
+"""
+from typing import Callable, Dict, List
+import statistics
+import tracemalloc
+import argparse
+import sqlite3
+import json
+import time
+import uuid
+import sys
+import os
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCHMARKS_DIR)
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, 'fixtures')
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'penelope'))
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'penelope_database_assistant'))
+
+BENCHMARKS: Dict[str, Callable[[], Callable[[], object]]] = {}
+
+
+def benchmark(name: str):
+    """Register a benchmark. The decorated setup function returns the callable to time."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, name)) as fixture:
+        return fixture.read()
+
+
+def load_fixture(name: str):
+    return json.loads(read_fixture(name))
+
+
+def sample_questions() -> List[str]:
+    questions = [
+        "What was bitcoin's price in May 2014?",
+        "What was ethereum's price in June 2018?",
+        "what's eth's market cap",
+        "What is the TVL of Arbitrum right now?",
+        "Compare SOL, AVAX and ETH by market cap and volume.",
+        "Give me the latest bitcoin news and how the market reacted.",
+        "Is the exchange hack going to affect solana's price this week?",
+        "Explain what a layer 2 rollup is and why fees are lower.",
+    ]
+    return questions * 2
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(fn: Callable[[], object], min_time: float, max_iterations: int = 200_000) -> dict:
+    """
+    Time `fn` repeatedly for at least `min_time` seconds.
+
+    Returns:
+    dict: Iterations, ops/s, latency percentiles (microseconds) and the peak memory
+    allocated by a single call (KiB, measured in a separate traced call).
+    """
+    fn()  # warm-up
+
+    latencies = []
+    deadline = time.perf_counter() + min_time
+    while time.perf_counter() < deadline and len(latencies) < max_iterations:
+        start = time.perf_counter_ns()
+        fn()
+        latencies.append(time.perf_counter_ns() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'iterations': len(latencies),
+        'ops_per_sec': len(latencies) / (sum(latencies) / 1e9),
+        'mean_us': statistics.fmean(latencies) / 1e3,
+        'p50_us': percentile(latencies, 0.50) / 1e3,
+        'p95_us': percentile(latencies, 0.95) / 1e3,
+        'p99_us': percentile(latencies, 0.99) / 1e3,
+        'peak_memory_kb': peak / 1024,
+    }
+
+
+# ------------------------------ CoinGecko ------------------------------------------
+
+@benchmark('token_data_parse')
+def token_data_parse():
+    import index
+
+    coin_text = read_fixture('coins_bitcoin.json')
+    history_text = read_fixture('coins_bitcoin_history.json')
+
+    def run():
+        coin = json.loads(coin_text)
+        history = json.loads(history_text)
+        return index.build_token_data(
+            index.parse_token_metadata(coin),
+            index.parse_market_data(coin),
+            index.parse_historical_price(history),
+        )
+    return run
+
+
+@benchmark('token_markets_row_parse')
+def token_markets_row_parse():
+    import index
+
+    markets_text = read_fixture('coins_markets.json')
+    return lambda: [index.parse_markets_row(row) for row in json.loads(markets_text)]
+
+
+# ------------------------------ DefiLlama ------------------------------------------
+
+@benchmark('llama_chains_sorted_scan')
+def llama_chains_sorted_scan():
+    # Reference: the sort and linear casefold scan that get_llama_chains used to do per call
+    chains = load_fixture('llama_chains.json')
+
+    def run():
+        sorted_data = sorted(chains, key=lambda item: item.get('tokenSymbol') or '')
+        for chain in sorted_data:
+            if 'arb' == str(chain['tokenSymbol']).casefold():
+                return chain
+    return run
+
+
+@benchmark('llama_chains_lookup')
+def llama_chains_lookup():
+    from llama_chains import LlamaChainsIndex
+
+    chains_index = LlamaChainsIndex()
+    chains_index.load(load_fixture('llama_chains.json'))
+    return lambda: chains_index.lookup('arb')
+
+
+@benchmark('llama_chains_bulk_tvl')
+def llama_chains_bulk_tvl():
+    from llama_chains import LlamaChainsIndex
+
+    chains_index = LlamaChainsIndex()
+    chains_index.load(load_fixture('llama_chains.json'))
+    symbols = ['ETH', 'SOL', 'ARB', 'OP', 'AVAX', 'MATIC', 'BNB', 'TRX', 'SUI', 'unknown']
+    return lambda: chains_index.bulk_tvl(symbols)
+
+
+@benchmark('llama_chains_snapshot_load')
+def llama_chains_snapshot_load():
+    from llama_chains import LlamaChainsIndex
+
+    chains_index = LlamaChainsIndex()
+    chains_text = read_fixture('llama_chains.json')
+    return lambda: chains_index.load(json.loads(chains_text))
+
+
+# ------------------------------ Chat history ---------------------------------------
+
+class SQLiteChatMessageHistory:
+    """
+    In-memory SQLite stand-in for the chat history table, with the same schema, message
+    serialization and windowed read as PooledChatMessageHistory.
+    """
+
+    def __init__(self, session_id: str, window: int = 10, max_tokens=None):
+        self.session_id = session_id
+        self.window = window
+        self.max_tokens = max_tokens
+        self.connection = sqlite3.connect(':memory:')
+        self.connection.execute(
+            "CREATE TABLE chat_history (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, message TEXT NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX idx_chat_history_session_id_id ON chat_history (session_id, id)")
+
+    @property
+    def messages(self):
+        from langchain_core.messages import messages_from_dict
+        from history import trim_to_tokens
+
+        rows = self.connection.execute(
+            "SELECT message FROM (SELECT id, message FROM chat_history WHERE session_id = ? ORDER BY id DESC LIMIT ?) ORDER BY id",
+            (self.session_id, self.window if self.window is not None else -1),
+        ).fetchall()
+        return trim_to_tokens(messages_from_dict([json.loads(row[0]) for row in rows]), self.max_tokens)
+
+    def add_messages(self, messages):
+        from langchain_core.messages import message_to_dict
+
+        self.connection.executemany(
+            "INSERT INTO chat_history (session_id, message) VALUES (?, ?)",
+            [(self.session_id, json.dumps(message_to_dict(message))) for message in messages],
+        )
+        self.connection.commit()
+
+
+def chat_history(window: int = 10, max_tokens=None, write_behind: bool = False):
+    session_id = str(uuid.uuid4())
+    postgres_url = os.getenv('BENCH_POSTGRES_URL')
+    if not postgres_url:
+        if write_behind:
+            raise OSError('BENCH_POSTGRES_URL is not set')
+        return SQLiteChatMessageHistory(session_id, window=window, max_tokens=max_tokens)
+
+    from langchain_postgres import PostgresChatMessageHistory
+    from history import HistoryWriter, PooledChatMessageHistory, create_window_index
+    from db_pool import create_pool
+
+    pool = create_pool(postgres_url, name='benchmarks')
+    with pool.connection() as connection:
+        PostgresChatMessageHistory.create_tables(connection, 'chat_history')
+        create_window_index(connection, 'chat_history')
+    writer = HistoryWriter(pool) if write_behind else None
+    return PooledChatMessageHistory('chat_history', session_id, pool=pool, window=window, max_tokens=max_tokens, writer=writer)
+
+
+def turn_messages(index: int):
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    answer = read_fixture('coins_bitcoin.json')[:1500]
+    return [AIMessage(content=f'{index}: {answer}'), HumanMessage(content=sample_questions()[index % 8])]
+
+
+@benchmark('history_round_trip')
+def history_round_trip():
+    history = chat_history(window=10)
+
+    # A long session, the windowed read must not depend on its length
+    for index in range(500):
+        history.add_messages(turn_messages(index))
+
+    turn = turn_messages(0)
+
+    def run():
+        history.add_messages(turn)
+        return history.messages
+    return run
+
+
+@benchmark('history_write_behind')
+def history_write_behind():
+    # The same turn as history_round_trip, the INSERT is queued and the read includes the queued turns
+    history = chat_history(window=10, write_behind=True)
+    for index in range(500):
+        history.add_messages(turn_messages(index))
+
+    turn = turn_messages(0)
+
+    def run():
+        history.add_messages(turn)
+        return history.messages
+    return run
+
+
+@benchmark('history_trim_to_tokens')
+def history_trim_to_tokens():
+    from history import trim_to_tokens
+
+    messages = [message for index in range(5) for message in turn_messages(index)]
+    return lambda: trim_to_tokens(messages, 1000)
+
+
+# ------------------------------ Tool selection -------------------------------------
+
+def tool_selection_setup():
+    from langchain_core.chat_history import InMemoryChatMessageHistory
+    from langchain_core.language_models.fake import FakeListLLM
+    from index import tools
+
+    llm = FakeListLLM(responses=['{"name": "get_token_data", "arguments": {"token_id": "bitcoin"}}'])
+    turns = [message for index in range(5) for message in turn_messages(index)]
+
+    # A fixed window of history, so only the chain itself is measured
+    def get_session_history(session_id: str):
+        return InMemoryChatMessageHistory(messages=list(turns))
+    return tools, llm, get_session_history
+
+
+def tool_selection_run(chain, question: str):
+    return chain.invoke({"input": question}, config={"configurable": {"session_id": "benchmark"}})
+
+
+@benchmark('tool_selection_chain_per_request')
+def tool_selection_chain_per_request():
+    # What every request used to pay: rendering the tools, the prompt and the runnable graph
+    from langchain.tools.render import render_text_description
+    from index import tool_selection_chain, tool_selection_prompt, tool_selection_system_prompt
+
+    tools, llm, get_session_history = tool_selection_setup()
+    question = sample_questions()[0]
+
+    def run():
+        system_prompt = tool_selection_system_prompt(render_text_description(tools))
+        chain = tool_selection_chain(tool_selection_prompt(system_prompt), llm, get_session_history)
+        return tool_selection_run(chain, question)
+    return run
+
+
+@benchmark('tool_selection_chain_prebuilt')
+def tool_selection_chain_prebuilt():
+    # The chain built once by Penelope, a request only binds its session through the config
+    from langchain.tools.render import render_text_description
+    from index import tool_selection_chain, tool_selection_prompt, tool_selection_system_prompt
+
+    tools, llm, get_session_history = tool_selection_setup()
+    system_prompt = tool_selection_system_prompt(render_text_description(tools))
+    chain = tool_selection_chain(tool_selection_prompt(system_prompt), llm, get_session_history)
+    question = sample_questions()[0]
+    return lambda: tool_selection_run(chain, question)
+
+
+# ------------------------------ Models ---------------------------------------------
+
+@benchmark('combined_keywords_batch')
+def combined_keywords_batch():
+    from main import KeywordExtractor
+
+    extractor = KeywordExtractor()
+    texts = sample_questions()
+    return lambda: extractor.combined_keywords_batch(texts)
+
+
+@benchmark('sentiment_classify')
+def sentiment_classify():
+    from emotional_classification_model import SentimentClassifier
+
+    classifier = SentimentClassifier()
+    texts = sample_questions() * 2
+    return lambda: classifier.classify(texts)
+
+
+# ------------------------------ Runner ---------------------------------------------
+
+def run_benchmarks(names: List[str], min_time: float) -> Dict[str, dict]:
+    results = {}
+    for name in names:
+        try:
+            fn = BENCHMARKS[name]()
+        except (ImportError, OSError) as e:
+            print(f'{name:<28} skipped: {str(e).splitlines()[0]}')
+            continue
+        results[name] = measure(fn, min_time)
+        result = results[name]
+        print(
+            f"{name:<28} {result['ops_per_sec']:>12.1f} ops/s"
+            f"  p50 {result['p50_us']:>10.1f}us  p95 {result['p95_us']:>10.1f}us  p99 {result['p99_us']:>10.1f}us"
+            f"  peak {result['peak_memory_kb']:>9.1f}KiB"
+        )
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Return the benchmarks whose ops/s dropped more than `tolerance` below the baseline."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['ops_per_sec'] / baseline[name]['ops_per_sec']
+        status = 'REGRESSION' if ratio < 1 - tolerance else 'ok'
+        print(f'{name:<28} {ratio:>6.2f}x baseline  {status}')
+        if status != 'ok':
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Penelope hot path microbenchmarks")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), default=None)
+    parser.add_argument('--min-time', type=float, default=1.0, help="Seconds spent timing each benchmark")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed ops/s drop relative to the baseline")
+    parser.add_argument('--json', default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.only or list(BENCHMARKS), args.min_time)
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as stored:
+                baseline = json.load(stored)
+        baseline.update(results)
+        with open(args.baseline, 'w') as output:
+            json.dump(baseline, output, indent=2)
+        print(f'Baseline saved to {args.baseline}')
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f'No baseline at {args.baseline}, run with --save-baseline first')
+            sys.exit(1)
+        with open(args.baseline) as stored:
+            regressions = compare(results, json.load(stored), args.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
@@ -0,0 +1,254 @@
+from quart import Blueprint, Quart, request, jsonify, make_response
+from quart_cors import cors
+import asyncio
+import time
+
+from index import (
+    PENELOPE_WARM_UP,
+    conn_info,
+    get_penelope,
+    get_pool,
+    is_ready,
+    logger,
+    set_async_pool,
+    startup_timings,
+    token_data_cache,
+    llama_chains_index,
+    semantic_cache,
+    completion_cache,
+    upstream_requests,
+    intent_router,
+    upstreams,
+    rate_limiters,
+    telemetry,
+    profiler,
+    profile_file,
+    trace_id,
+    incoming_trace_id,
+    TRACING_ENABLED,
+    PROMETHEUS_CONTENT_TYPE,
+    close_async_http_session,
+    close_penelope,
+    ndjson_line,
+    parse_batch,
+    sse_event,
+    warm_up,
+)
+from db_pool import create_async_pool, pool_metrics
+
+# Asyncio serving mode for Penelope, e.g. `uvicorn asgi:app --host 0.0.0.0 --port 5000`.
+# The Flask app in index.py stays available as the synchronous serving mode.
+
+api = Blueprint('api', __name__)
+async_pool = None
+warm_up_task = None
+
+
+async def aget_penelope():
+    # Building Penelope opens the sync pool and checks the table, keep that off the event loop
+    if is_ready():
+        return get_penelope()
+    return await asyncio.to_thread(get_penelope)
+
+
+@api.before_app_serving
+async def startup():
+    global async_pool, warm_up_task
+    async_pool = await create_async_pool(conn_info)
+    set_async_pool(async_pool)
+
+    # Warm up in the background so the server binds its port right away, /ready reports when done
+    if PENELOPE_WARM_UP != 'lazy':
+        warm_up_task = asyncio.create_task(asyncio.to_thread(warm_up))
+
+
+@api.after_app_serving
+async def shutdown():
+    # Queued history turns are written before the pools go away
+    await asyncio.to_thread(close_penelope)
+    await close_async_http_session()
+    if async_pool is not None:
+        await async_pool.close()
+
+
+@api.before_app_request
+async def record_first_request():
+    if 'first_request' not in startup_timings:
+        startup_timings['first_request'] = time.perf_counter() - startup_timings['import_started']
+
+
+@api.before_app_request
+async def start_trace():
+    # Each request is served in its own task, the trace ID stays in its context
+    if TRACING_ENABLED:
+        trace_id.set(incoming_trace_id(request.headers))
+
+
+@api.after_app_request
+async def add_trace_header(response):
+    if trace_id.get() is not None:
+        response.headers['X-Trace-ID'] = trace_id.get()
+    if profile_file.get() is not None:
+        response.headers['X-Profile-File'] = profile_file.get()
+    return response
+
+
+@api.route('/process', methods=['POST'])
+async def process():
+    try:
+        user_input = await request.get_json()
+
+        if not user_input:
+            raise ValueError("No JSON data provided")
+
+        penelope = await aget_penelope()
+        with telemetry.span('request'), profiler.profile(request.headers, trace_id.get()):
+            output = await penelope.aprocess_input(user_input)
+
+        if output['success']:
+            response = output['response']
+        else:
+            response = output['error']
+
+        return jsonify({'response': response, 'success': output['success']})
+
+    except ValueError as ve:
+        return jsonify({'response': f"ValueError: {str(ve)}", 'success': False})
+
+    except Exception as e:
+        return jsonify({'response': f"Exception: {str(e)}", 'success': False})
+
+
+@api.route('/process/stream', methods=['POST'])
+async def process_stream():
+    """Stream the answer of /process as Server-Sent Events."""
+    user_input = await request.get_json(silent=True)
+
+    async def generate():
+        if not user_input:
+            yield sse_event('error', {'success': False, 'error': "ValueError: No JSON data provided"})
+            return
+
+        try:
+            penelope = await aget_penelope()
+        except Exception as e:
+            logger.exception('Penelope unavailable')
+            yield sse_event('error', {'success': False, 'error': f"Exception: {str(e)}"})
+            return
+
+        async for event, data in penelope.aprocess_input_stream(user_input):
+            yield sse_event(event, data)
+
+    response = await make_response(
+        generate(),
+        200,
+        {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Long market summaries can outlive the default response timeout
+    response.timeout = None
+    return response
+
+
+@api.route('/process/batch', methods=['POST'])
+async def process_batch():
+    """Answer a list of {'session_id', 'input'} items, see the /process/batch route of index.py."""
+    try:
+        items, concurrency, stream = parse_batch(await request.get_json(silent=True), request.headers)
+        penelope = await aget_penelope()
+
+    except ValueError as ve:
+        return jsonify({'response': f"ValueError: {str(ve)}", 'success': False})
+
+    except Exception as e:
+        logger.exception('Penelope unavailable')
+        return jsonify({'response': f"Exception: {str(e)}", 'success': False})
+
+    if stream:
+        async def generate():
+            async for index, output in penelope.aprocess_batch(items, concurrency):
+                yield ndjson_line(index, output)
+
+        response = await make_response(
+            generate(),
+            200,
+            {'Content-Type': 'application/x-ndjson', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        # A large batch can outlive the default response timeout
+        response.timeout = None
+        return response
+
+    results = [None] * len(items)
+    with telemetry.span('batch'):
+        async for index, output in penelope.aprocess_batch(items, concurrency):
+            results[index] = output
+    return jsonify({'results': results, 'success': True})
+
+
+@api.route('/pool/stats')
+async def pool_stats():
+    stats = {'sync': pool_metrics(get_pool())}
+    if async_pool is not None:
+        stats['async'] = pool_metrics(async_pool)
+    return jsonify(stats)
+
+
+@api.route('/history/stats')
+async def history_stats():
+    penelope = await aget_penelope()
+    return jsonify(penelope.history_writer.metrics() if penelope.history_writer is not None else {'enabled': False})
+
+
+@api.route('/upstream/stats')
+async def upstream_stats():
+    return jsonify({name: upstream.metrics() for name, upstream in upstreams.items()})
+
+
+@api.route('/rate_limit/stats')
+async def rate_limit_stats():
+    return jsonify({name: limiter.metrics() for name, limiter in rate_limiters.items()})
+
+
+@api.route('/metrics')
+async def metrics():
+    return telemetry.render(), 200, {'Content-Type': PROMETHEUS_CONTENT_TYPE}
+
+
+@api.route('/stage/stats')
+async def stage_stats():
+    return jsonify(telemetry.metrics())
+
+
+@api.route('/cache/stats')
+async def cache_stats():
+    return jsonify({
+        'token_data': token_data_cache.metrics(),
+        'llama_chains': llama_chains_index.metrics(),
+        'semantic': semantic_cache.metrics(),
+        'completions': completion_cache.metrics(),
+        'upstream_requests': upstream_requests.metrics(),
+        'router': intent_router.metrics(),
+    })
+
+
+@api.route('/ready')
+async def ready():
+    if not is_ready():
+        return jsonify({'ready': False, 'startup': startup_timings}), 503
+    return jsonify({'ready': True, 'startup': startup_timings})
+
+
+@api.route('/')
+async def home():
+    return "Penelope API is running"
+
+
+def create_app() -> Quart:
+    app = Quart(__name__)
+    app.register_blueprint(api)
+    return cors(app)
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    app.run(host='0.0.0.0', port=5000)
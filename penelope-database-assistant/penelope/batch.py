@@ -0,0 +1,64 @@
+from typing import List, Mapping, Optional, Tuple
+import json
+import uuid
+
+from semantic_cache import question_text
+
+
+def parse_batch(body, headers: Mapping[str, str], max_items: int, max_concurrency: int) -> Tuple[List[dict], int, bool]:
+    """
+    Read a /process/batch request.
+
+    Parameters:
+    body: The JSON body, a list of {'session_id', 'input'} items or {'items': [...], 'concurrency': int, 'stream': bool}.
+    headers (Mapping[str, str]): The request headers, `Accept: application/x-ndjson` also asks for a stream.
+    max_items (int): The largest batch accepted.
+    max_concurrency (int): The most questions of one batch answered at once, also the default.
+
+    Returns:
+    Tuple[List[dict], int, bool]: The items, the concurrency of the batch and whether to stream the results.
+
+    Raises:
+    ValueError: When the body holds no items or too many.
+    """
+    options = body if isinstance(body, dict) else {}
+    items = options.get('items') if isinstance(body, dict) else body
+    if not isinstance(items, list) or not items:
+        raise ValueError("Expected a non-empty list of {'session_id', 'input'} items")
+    if len(items) > max_items:
+        raise ValueError(f"At most {max_items} items per batch, got {len(items)}")
+    concurrency = min(max(int(options.get('concurrency') or max_concurrency), 1), max_concurrency)
+    stream = bool(options.get('stream')) or 'application/x-ndjson' in headers.get('Accept', '')
+    return items, concurrency, stream
+
+
+def batch_item_error(item) -> Optional[str]:
+    if not isinstance(item, dict) or item.get('input') in (None, ''):
+        return "ValueError: No input provided"
+    if item.get('session_id') is not None:
+        try:
+            uuid.UUID(str(item['session_id']))
+        except ValueError:
+            return f"ValueError: session_id {item['session_id']!r} is not a UUID"
+    return None
+
+
+def group_batch(items: List[dict]) -> Tuple[List[Tuple[int, dict]], List[List[int]]]:
+    """
+    Split a batch into the outputs of its invalid items and the indexes of its valid items, grouped by question.
+
+    Returns:
+    Tuple: The (index, output) of each invalid item, and the item indexes of each distinct question in batch order.
+    """
+    invalid, groups = [], {}
+    for index, item in enumerate(items):
+        error = batch_item_error(item)
+        if error is not None:
+            invalid.append((index, {'success': False, 'error': error, 'response': None}))
+        else:
+            groups.setdefault(question_text(item['input']), []).append(index)
+    return invalid, list(groups.values())
+
+
+def ndjson_line(index: int, output: dict) -> str:
+    return json.dumps({'index': index, **output}, default=str) + "\n"
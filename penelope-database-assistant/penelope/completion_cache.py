@@ -0,0 +1,197 @@
+from typing import Awaitable, Callable, Optional
+import threading
+import asyncio
+import sqlite3
+import xxhash
+import time
+import os
+
+from ttl_cache import TTLCache
+
+
+def completion_key(model: str, deployment_id: str, prompt: str) -> str:
+    """Hash of everything that determines a completion."""
+    return xxhash.xxh3_128_hexdigest(f'{model}\x00{deployment_id}\x00{prompt}'.encode('utf-8'))
+
+
+class CompletionCache:
+    """
+    Exact-match cache of LLM completions, keyed by `completion_key`.
+
+    Lookups go to an in-memory LRU first, then to a SQLite file shared by every worker
+    process and kept across restarts. Disk hits are promoted to memory for the rest of
+    their TTL. The disk tier is pruned to `max_disk_entries` (expired entries first, then
+    the oldest) every `prune_interval` writes. Disk errors are counted and otherwise
+    ignored, the caller then just pays for the LLM call.
+    """
+
+    def __init__(self, path: str, memory_size: int = 1024, max_disk_entries: int = 100_000, default_ttl: float = 24 * 3600,
+                 prune_interval: int = 100, enabled: bool = True, name: str = 'completions'):
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.default_ttl = default_ttl
+        self.prune_interval = prune_interval
+        self.enabled = enabled
+        self.name = name
+        self.memory = TTLCache(maxsize=memory_size, name=f'{name}-memory')
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.initialized = False
+        self.writes = 0
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'bypassed': 0,
+            'disk_evictions': 0,
+            'disk_errors': 0,
+        }
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, opened on first use
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with self.lock:
+                if not self.initialized:
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS completions ("
+                        "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+                    )
+                    connection.execute("CREATE INDEX IF NOT EXISTS idx_completions_created_at ON completions (created_at)")
+                    self.initialized = True
+            self.local.connection = connection
+        return connection
+
+    def after_fork(self):
+        """Forget the connections inherited from the parent process, SQLite connections must not cross a fork."""
+        self.local = threading.local()
+
+    def _count(self, stat: str, amount: int = 1):
+        with self.lock:
+            self.stats[stat] += amount
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('memory_hits')
+            return value
+        return self._disk_get(key)
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        now = time.time()
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM completions WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f'{self.name} cache read error: {str(e)}')
+            self._count('disk_errors')
+            row = None
+
+        if row is None:
+            self._count('misses')
+            return None
+
+        value, expires_at = row
+        self.memory.set(key, value, expires_at - now)
+        self._count('disk_hits')
+        return value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        ttl = self.default_ttl if ttl is None else ttl
+        now = time.time()
+        self.memory.set(key, value, ttl)
+        try:
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO completions (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now + ttl)
+            )
+            with self.lock:
+                self.stats['stores'] += 1
+                self.writes += 1
+                prune = self.writes % self.prune_interval == 0
+            if prune:
+                self.prune(connection)
+        except sqlite3.Error as e:
+            print(f'{self.name} cache write error: {str(e)}')
+            self._count('disk_errors')
+
+    def prune(self, connection: Optional[sqlite3.Connection] = None):
+        """Drop expired entries, then the oldest ones above `max_disk_entries`."""
+        connection = connection or self._connection()
+        removed = connection.execute("DELETE FROM completions WHERE expires_at <= ?", (time.time(),)).rowcount
+        excess = connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0] - self.max_disk_entries
+        if excess > 0:
+            removed += connection.execute(
+                "DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY created_at LIMIT ?)", (excess,)
+            ).rowcount
+        self._count('disk_evictions', removed)
+
+    def get_or_call(self, key: str, call: Callable[[], Optional[str]], ttl: Optional[float] = None, use_cache: bool = True,
+                    cacheable: Callable[[str], bool] = None) -> Optional[str]:
+        """
+        Return the cached completion for `key`, calling the model on a miss.
+
+        Parameters:
+        key (str): The `completion_key` of the call.
+        call (Callable): Blocking function returning the completion, or None on failure.
+        ttl (float): Seconds the completion is served from the cache, `default_ttl` when None.
+        use_cache (bool): False to always call the model, the result is not stored either.
+        cacheable (Callable): Optional check on the completion, e.g. to skip error messages.
+
+        Returns:
+        Optional[str]: The cached or fresh completion.
+        """
+        if not (self.enabled and use_cache):
+            self._count('bypassed')
+            return call()
+
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        value = call()
+        if value is not None and (cacheable is None or cacheable(value)):
+            self.set(key, value, ttl)
+        return value
+
+    async def aget_or_call(self, key: str, call: Callable[[], Awaitable[Optional[str]]], ttl: Optional[float] = None,
+                           use_cache: bool = True, cacheable: Callable[[str], bool] = None) -> Optional[str]:
+        """Async variant of `get_or_call`, the disk tier is read and written in the default executor."""
+        if not (self.enabled and use_cache):
+            self._count('bypassed')
+            return await call()
+
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('memory_hits')
+            return value
+
+        value = await asyncio.to_thread(self._disk_get, key)
+        if value is not None:
+            return value
+
+        value = await call()
+        if value is not None and (cacheable is None or cacheable(value)):
+            await asyncio.to_thread(self.set, key, value, ttl)
+        return value
+
+    def clear(self):
+        self.memory.clear()
+        self._connection().execute("DELETE FROM completions")
+
+    def metrics(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        hits = stats['memory_hits'] + stats['disk_hits']
+        lookups = hits + stats['misses']
+        stats['memory_size'] = self.memory.metrics()['size']
+        stats['enabled'] = self.enabled
+        stats['hit_rate'] = hits / lookups if lookups else 0.0
+        return stats
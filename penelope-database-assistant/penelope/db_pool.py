@@ -0,0 +1,101 @@
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
+import dotenv
+import os
+
+# Load environment variables from a .env file
+dotenv.load_dotenv()
+
+# Pool configuration, size max_size against the number of Flask threads / ASGI workers
+PG_POOL_MIN_SIZE = int(os.getenv('PG_POOL_MIN_SIZE', 2))
+PG_POOL_MAX_SIZE = int(os.getenv('PG_POOL_MAX_SIZE', 10))
+PG_POOL_MAX_IDLE = float(os.getenv('PG_POOL_MAX_IDLE', 300))
+PG_POOL_MAX_LIFETIME = float(os.getenv('PG_POOL_MAX_LIFETIME', 3600))
+PG_POOL_TIMEOUT = float(os.getenv('PG_POOL_TIMEOUT', 5))
+
+
+def pool_options() -> dict:
+    return {
+        'min_size': PG_POOL_MIN_SIZE,
+        'max_size': PG_POOL_MAX_SIZE,
+        'max_idle': PG_POOL_MAX_IDLE,
+        'max_lifetime': PG_POOL_MAX_LIFETIME,
+        'timeout': PG_POOL_TIMEOUT,
+    }
+
+
+def create_pool(conn_info: str, name: str = 'penelope') -> ConnectionPool:
+    """
+    Open a sync connection pool for the chat history.
+
+    Connections are health-checked on checkout, so a dropped connection is replaced
+    instead of failing every request that shares it.
+
+    Parameters:
+    conn_info (str): The Postgres connection string.
+    name (str): The pool name, reported in the metrics.
+
+    Returns:
+    ConnectionPool: The opened pool.
+    """
+    return ConnectionPool(
+        conn_info,
+        name=name,
+        check=ConnectionPool.check_connection,
+        open=True,
+        **pool_options()
+    )
+
+
+async def create_async_pool(conn_info: str, name: str = 'penelope-async') -> AsyncConnectionPool:
+    """
+    Open an async connection pool for the chat history, used by the asyncio serving mode.
+
+    Parameters:
+    conn_info (str): The Postgres connection string.
+    name (str): The pool name, reported in the metrics.
+
+    Returns:
+    AsyncConnectionPool: The opened pool.
+    """
+    pool = AsyncConnectionPool(
+        conn_info,
+        name=name,
+        check=AsyncConnectionPool.check_connection,
+        open=False,
+        **pool_options()
+    )
+    await pool.open()
+    return pool
+
+
+def pool_metrics(pool) -> dict:
+    """
+    Summarize the statistics of a sync or async pool.
+
+    Parameters:
+    pool (ConnectionPool | AsyncConnectionPool): The pool to inspect.
+
+    Returns:
+    dict: Pool size, connections in use, checkout count, wait time and failed checkouts.
+    """
+    stats = pool.get_stats()
+    size = stats.get('pool_size', 0)
+    available = stats.get('pool_available', 0)
+    checkouts = stats.get('requests_num', 0)
+    wait_ms = stats.get('requests_wait_ms', 0)
+
+    return {
+        'name': pool.name,
+        'min_size': pool.min_size,
+        'max_size': pool.max_size,
+        'size': size,
+        'available': available,
+        'in_use': size - available,
+        'requests_waiting': stats.get('requests_waiting', 0),
+        'checkouts': checkouts,
+        'wait_ms_total': wait_ms,
+        'wait_ms_avg': wait_ms / checkouts if checkouts else 0.0,
+        'failed_checkouts': stats.get('requests_errors', 0),
+        'connections_lost': stats.get('connections_lost', 0),
+        'connections_errors': stats.get('connections_errors', 0),
+    }
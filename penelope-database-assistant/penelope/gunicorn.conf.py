@@ -0,0 +1,33 @@
+import multiprocessing
+import os
+
+# Multi-process serving mode, run from this directory:
+#
+#   gunicorn -c gunicorn.conf.py 'index:create_app()'                          (Flask, threaded workers)
+#   gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app     (Quart, one event loop per worker)
+#
+# The master imports index and preloads PRELOAD_MODELS (e.g. PRELOAD_MODELS=ner,sentiment,embeddings) before
+# forking, so the workers share the model weights copy-on-write. The app itself is loaded in every worker
+# (no preload_app): each one opens its own DB pools, HTTP sessions and threads and warms up on its own.
+# `uvicorn --workers` spawns fresh interpreters instead of forking, every worker then loads its own models.
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = os.getenv('WORKER_CLASS', 'gthread')
+threads = int(os.getenv('WORKER_THREADS', 8))
+# Longer than the request deadline, so answers are not cut short by the worker timeout
+timeout = int(float(os.getenv('REQUEST_DEADLINE', 60))) + 30
+graceful_timeout = 30
+preload_app = False
+
+
+def on_starting(server):
+    import index
+
+    index.preload_models()
+
+
+def post_fork(server, worker):
+    import index
+
+    index.init_worker(server.cfg.workers)
@@ -0,0 +1,159 @@
+from contextlib import nullcontext
+from typing import List, Optional, Sequence
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, messages_from_dict
+from psycopg import sql
+
+from history_writer import HistoryQueueFull, HistoryWriter
+
+
+def approximate_text_tokens(text: str) -> int:
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+
+def approximate_tokens(message: BaseMessage) -> int:
+    return approximate_text_tokens(str(message.content))
+
+
+def trim_to_tokens(messages: List[BaseMessage], max_tokens: Optional[int]) -> List[BaseMessage]:
+    """
+    Keep the most recent messages that fit in `max_tokens`.
+
+    Parameters:
+    messages (List[BaseMessage]): The messages, oldest first.
+    max_tokens (Optional[int]): The token budget, None to keep every message.
+
+    Returns:
+    List[BaseMessage]: The trailing messages within the budget.
+    """
+    if max_tokens is None:
+        return messages
+
+    total = 0
+    start = len(messages)
+    for index in range(len(messages) - 1, -1, -1):
+        total += approximate_tokens(messages[index])
+        if total > max_tokens:
+            break
+        start = index
+    return messages[start:]
+
+
+def create_window_index(connection, table_name: str):
+    """
+    Create the (session_id, id) index used by the windowed history reads.
+
+    Parameters:
+    connection (psycopg.Connection): A sync connection.
+    table_name (str): The chat history table.
+    """
+    query = sql.SQL("CREATE INDEX IF NOT EXISTS {index} ON {table} (session_id, id);").format(
+        index=sql.Identifier(f"idx_{table_name}_session_id_id"),
+        table=sql.Identifier(table_name),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(query)
+    connection.commit()
+
+
+class PooledChatMessageHistory(BaseChatMessageHistory):
+    """
+    Postgres chat history that checks a connection out of a pool for every operation.
+
+    Connections are only held for the duration of a read or write, never while the
+    LLM calls of a request are running. Reads only fetch the last `window` messages of
+    the session with a bounded query, optionally trimmed further to `max_tokens`, so the
+    cost of a turn does not grow with the length of the conversation. Reads and writes are
+    timed as the 'history_read' and 'history_write' spans of `telemetry` when it is given.
+    With a `writer`, writes are queued to it and reads include the turns it has not written yet.
+    """
+
+    def __init__(self, table_name: str, session_id: str, pool=None, async_pool=None, window: Optional[int] = None, max_tokens: Optional[int] = None,
+                 telemetry=None, writer: Optional[HistoryWriter] = None):
+        if pool is None and async_pool is None:
+            raise ValueError("Must provide a pool or an async pool")
+
+        self.table_name = table_name
+        self.session_id = session_id
+        self.pool = pool
+        self.async_pool = async_pool
+        self.window = window
+        self.max_tokens = max_tokens
+        self.telemetry = telemetry
+        self.writer = writer
+
+    def _span(self, stage: str):
+        return self.telemetry.span(stage) if self.telemetry is not None else nullcontext()
+
+    def _history(self, sync_connection=None, async_connection=None):
+        from langchain_postgres import PostgresChatMessageHistory
+
+        return PostgresChatMessageHistory(
+            self.table_name,
+            self.session_id,
+            sync_connection=sync_connection,
+            async_connection=async_connection
+        )
+
+    def _window_query(self):
+        # LIMIT NULL reads the whole session when no window is configured
+        return sql.SQL(
+            "SELECT message FROM ("
+            "SELECT id, message FROM {table} WHERE session_id = %(session_id)s ORDER BY id DESC LIMIT %(limit)s"
+            ") AS recent ORDER BY id;"
+        ).format(table=sql.Identifier(self.table_name))
+
+    def _pending(self) -> List[BaseMessage]:
+        # Read before the table, see HistoryWriter.pending
+        return self.writer.pending(self.table_name, self.session_id) if self.writer is not None else []
+
+    def _parse_rows(self, rows, pending: List[BaseMessage]) -> List[BaseMessage]:
+        messages = messages_from_dict([row[0] for row in rows])
+        if pending:
+            # Turns are written in queue order: once a queued message is in the table, so are the ones before it
+            stored = {message.id for message in messages if message.id is not None}
+            written = max((index for index, message in enumerate(pending) if message.id in stored), default=-1)
+            messages += pending[written + 1:]
+            if self.window is not None:
+                messages = messages[-self.window:]
+        return trim_to_tokens(messages, self.max_tokens)
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        pending = self._pending()
+        with self._span('history_read'), self.pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(self._window_query(), {"session_id": self.session_id, "limit": self.window})
+                return self._parse_rows(cursor.fetchall(), pending)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if self.writer is not None:
+            self.writer.add(self.table_name, self.session_id, messages)
+            return
+        with self._span('history_write'), self.pool.connection() as connection:
+            self._history(sync_connection=connection).add_messages(messages)
+
+    def clear(self) -> None:
+        with self.pool.connection() as connection:
+            self._history(sync_connection=connection).clear()
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        pending = self._pending()
+        with self._span('history_read'):
+            async with self.async_pool.connection() as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.execute(self._window_query(), {"session_id": self.session_id, "limit": self.window})
+                    return self._parse_rows(await cursor.fetchall(), pending)
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if self.writer is not None:
+            await self.writer.aadd(self.table_name, self.session_id, messages)
+            return
+        with self._span('history_write'):
+            async with self.async_pool.connection() as connection:
+                await self._history(async_connection=connection).aadd_messages(messages)
+
+    async def aclear(self) -> None:
+        async with self.async_pool.connection() as connection:
+            await self._history(async_connection=connection).aclear()
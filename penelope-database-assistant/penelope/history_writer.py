@@ -0,0 +1,227 @@
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Tuple
+import threading
+import asyncio
+import logging
+import queue
+import json
+import time
+import uuid
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+
+logger = logging.getLogger('penelope.history')
+
+
+def insert_query(table_name: str, rows: int):
+    """A multi-row INSERT of `rows` (session_id, message) pairs into `table_name`."""
+    from psycopg import sql
+
+    return sql.SQL("INSERT INTO {table} (session_id, message) VALUES {values}").format(
+        table=sql.Identifier(table_name),
+        values=sql.SQL(', ').join([sql.SQL("(%s, %s)")] * rows),
+    )
+
+
+class HistoryQueueFull(Exception):
+    pass
+
+
+class HistoryWriter:
+    """
+    Write-behind persistence of chat turns.
+
+    `add` queues the messages of a turn and returns. A background thread drains the queue and
+    writes what it holds with one multi-row INSERT per table, up to `batch_size` rows, after
+    waiting at most `flush_interval` seconds for more turns; under load many turns share one
+    round trip. When the queue is full, `add` blocks for up to `enqueue_timeout` seconds
+    (backpressure), then raises `HistoryQueueFull`. Queued turns are returned by `pending`
+    until they are written, so the reads of this process see them; their messages are given
+    IDs, so a reader can tell which of them are in the table already. `close` writes what is left.
+    A batch still failing after `retries` retries is dropped and logged with its session IDs.
+    Messages are stored as the JSON of `serialize(message)`, langchain's `message_to_dict` by default.
+    """
+
+    def __init__(self, pool, max_queue: int = 1000, batch_size: int = 200, flush_interval: float = 0.05,
+                 enqueue_timeout: float = 1.0, retries: int = 2, telemetry=None, name: str = 'history_writer',
+                 serialize: Optional[Callable[['BaseMessage'], dict]] = None):
+        if serialize is None:
+            from langchain_core.messages import message_to_dict as serialize
+        self.pool = pool
+        self.serialize = serialize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.retries = retries
+        self.telemetry = telemetry
+        self.name = name
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.pending_turns: Dict[Tuple[str, str], List[tuple]] = {}
+        self.stopping = threading.Event()
+        self.thread = None
+        self.stats = {
+            'queued': 0,
+            'turns_written': 0,
+            'rows_written': 0,
+            'flushes': 0,
+            'flush_seconds': 0.0,
+            'queue_full': 0,
+            'write_errors': 0,
+            'dropped': 0,
+        }
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self.thread.start()
+
+    def add(self, table_name: str, session_id: str, messages: Sequence['BaseMessage']):
+        """Queue the messages of a turn, waiting for room when the queue is full."""
+        if self.stopping.is_set():
+            raise HistoryQueueFull(f"{self.name} is closed")
+        self.start()
+        turn = self._turn(table_name, session_id, messages)
+        self._track(turn)
+        try:
+            self.queue.put(turn, timeout=self.enqueue_timeout)
+        except queue.Full:
+            self._untrack([turn])
+            with self.lock:
+                self.stats['queue_full'] += 1
+            raise HistoryQueueFull(f"{self.name} queue stayed full for {self.enqueue_timeout}s")
+        with self.lock:
+            self.stats['queued'] += 1
+
+    async def aadd(self, table_name: str, session_id: str, messages: Sequence['BaseMessage']):
+        """Async variant of `add`, only a full queue is waited on, off the event loop."""
+        if self.stopping.is_set():
+            raise HistoryQueueFull(f"{self.name} is closed")
+        self.start()
+        turn = self._turn(table_name, session_id, messages)
+        self._track(turn)
+        try:
+            self.queue.put_nowait(turn)
+        except queue.Full:
+            self._untrack([turn])
+            await asyncio.to_thread(self.add, table_name, session_id, messages)
+            return
+        with self.lock:
+            self.stats['queued'] += 1
+
+    def _turn(self, table_name: str, session_id: str, messages: Sequence['BaseMessage']) -> tuple:
+        # The IDs are stored with the messages, they tell a queued message from its written copy
+        for message in messages:
+            if message.id is None:
+                message.id = str(uuid.uuid4())
+        return table_name, str(session_id), list(messages)
+
+    def _track(self, turn: tuple):
+        with self.lock:
+            self.pending_turns.setdefault(turn[:2], []).append(turn)
+
+    def _untrack(self, turns: List[tuple]):
+        with self.lock:
+            for turn in turns:
+                session_turns = self.pending_turns.get(turn[:2], [])
+                for index, pending_turn in enumerate(session_turns):
+                    if pending_turn is turn:
+                        del session_turns[index]
+                        break
+                if not session_turns:
+                    self.pending_turns.pop(turn[:2], None)
+
+    def pending(self, table_name: str, session_id: str) -> List['BaseMessage']:
+        """
+        The messages of a session that are queued or being written, oldest first.
+
+        A turn leaves this list once its INSERT is committed, so a reader must call it before
+        reading the table: a turn written in between is then in both, never in neither.
+        """
+        with self.lock:
+            session_turns = list(self.pending_turns.get((table_name, str(session_id)), ()))
+        return [message for turn in session_turns for message in turn[2]]
+
+    def _next_batch(self) -> List[tuple]:
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        rows = len(batch[0][2])
+        # Closing writes right away, otherwise later turns get `flush_interval` to join the batch
+        end = time.monotonic() + (0 if self.stopping.is_set() else self.flush_interval)
+        while rows < self.batch_size:
+            try:
+                turn = self.queue.get(timeout=max(end - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            batch.append(turn)
+            rows += len(turn[2])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+            elif self.stopping.is_set():
+                return
+
+    def _flush(self, batch: List[tuple]):
+        # One statement per table, rows in queue order so every session keeps its message order
+        tables: Dict[str, list] = {}
+        for table_name, session_id, messages in batch:
+            params = tables.setdefault(table_name, [])
+            for message in messages:
+                params += [session_id, json.dumps(self.serialize(message))]
+
+        start = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                with self._span('history_flush'), self.pool.connection() as connection:
+                    with connection.cursor() as cursor:
+                        for table_name, params in tables.items():
+                            cursor.execute(insert_query(table_name, len(params) // 2), params)
+                break
+            except Exception as e:
+                logger.warning('%s write error: %s', self.name, e)
+                with self.lock:
+                    self.stats['write_errors'] += 1
+                if attempt == self.retries:
+                    sessions = sorted({(table_name, session_id) for table_name, session_id, _ in batch})
+                    logger.error('%s dropped %d turns after %d attempts, sessions: %s', self.name, len(batch),
+                                 self.retries + 1, ', '.join(f'{table}/{session}' for table, session in sessions))
+                    with self.lock:
+                        self.stats['dropped'] += len(batch)
+                    self._untrack(batch)
+                    return
+                time.sleep(0 if self.stopping.is_set() else 0.5 * 2 ** attempt)
+
+        self._untrack(batch)
+        with self.lock:
+            self.stats['flushes'] += 1
+            self.stats['turns_written'] += len(batch)
+            self.stats['rows_written'] += sum(len(params) // 2 for params in tables.values())
+            self.stats['flush_seconds'] += time.perf_counter() - start
+
+    def _span(self, stage: str):
+        return self.telemetry.span(stage) if self.telemetry is not None else nullcontext()
+
+    def close(self, timeout: Optional[float] = 10.0):
+        """Stop accepting turns and wait up to `timeout` seconds for the queued ones to be written."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def metrics(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        stats['queue_depth'] = self.queue.qsize()
+        stats['queue_size'] = self.queue.maxsize
+        stats['rows_per_flush'] = stats['rows_written'] / stats['flushes'] if stats['flushes'] else 0.0
+        stats['flush_ms_avg'] = stats['flush_seconds'] * 1000 / stats['flushes'] if stats['flushes'] else 0.0
+        return stats
@@ -0,0 +1,373 @@
+from typing import Callable, Dict, List, NamedTuple, Optional
+import threading
+import time
+import re
+
+from semantic_cache import CONTEXTUAL_TERMS
+
+# CoinGecko IDs of the coins users ask about most, by lowercase name or symbol.
+# Chains of the DefiLlama index extend this with their name, token symbol and gecko_id.
+COIN_ALIASES = {
+    'bitcoin': 'bitcoin', 'btc': 'bitcoin', 'xbt': 'bitcoin',
+    'ethereum': 'ethereum', 'eth': 'ethereum', 'ether': 'ethereum',
+    'solana': 'solana', 'sol': 'solana',
+    'avalanche': 'avalanche-2', 'avax': 'avalanche-2',
+    'bnb': 'binancecoin', 'binance coin': 'binancecoin',
+    'xrp': 'ripple', 'ripple': 'ripple',
+    'cardano': 'cardano', 'ada': 'cardano',
+    'dogecoin': 'dogecoin', 'doge': 'dogecoin',
+    'tron': 'tron', 'trx': 'tron',
+    'polkadot': 'polkadot', 'dot': 'polkadot',
+    'polygon': 'matic-network', 'matic': 'matic-network',
+    'chainlink': 'chainlink', 'link': 'chainlink',
+    'litecoin': 'litecoin', 'ltc': 'litecoin',
+    'arbitrum': 'arbitrum', 'arb': 'arbitrum',
+    'optimism': 'optimism', 'op': 'optimism',
+    'toncoin': 'the-open-network', 'ton': 'the-open-network',
+    'near': 'near', 'cosmos': 'cosmos', 'atom': 'cosmos',
+    'aptos': 'aptos', 'apt': 'aptos', 'sui': 'sui',
+    'tether': 'tether', 'usdt': 'tether', 'usdc': 'usd-coin',
+}
+
+# Symbols that are also common English words only count when written in capitals ("OP", "$LINK")
+AMBIGUOUS_SYMBOLS = {'dot', 'link', 'near', 'op', 'ton', 'sui', 'apt', 'atom', 'one', 'gas', 'ar', 'celo', 'metis'}
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'at', 'by', 'for', 'from', 'how', 'in', 'is', 'it', 'me', 'much', 'of', 'on',
+    'the', 'to', 'vs', 'was', 'what', 'whats', "what's", 'when', 'with', 'right', 'now', 'today', 'current',
+    'price', 'market', 'cap', 'volume', 'supply', 'tvl', 'news', 'latest',
+}
+
+# Words often found right next to a coin name that are not part of it, see `IntentRouter.unknown_neighbours`
+NEIGHBOUR_WORDS = STOPWORDS | {
+    'about', 'all', 'between', 'chain', 'check', 'coin', 'coins', 'compare', 'did', 'do', 'does', 'get', 'give',
+    'had', 'has', 'have', 'high', 'i', 'its', 'like', 'locked', 'look', 'low', 'many', 'my', 'network', 'or',
+    'please', 'show', 'tell', 'than', 'time', 'token', 'tokens', 'total', 'trading', 'usd', 'value', 'versus',
+    'were', 'you', 'define', 'definition', 'mean', 'means', 'meaning', 'can', 'could', 'this', 'that', 'which',
+}
+
+MONTHS = {
+    name: index
+    for index, names in enumerate([
+        ('january', 'jan'), ('february', 'feb'), ('march', 'mar'), ('april', 'apr'), ('may',), ('june', 'jun'),
+        ('july', 'jul'), ('august', 'aug'), ('september', 'sep', 'sept'), ('october', 'oct'), ('november', 'nov'),
+        ('december', 'dec'),
+    ], start=1)
+    for name in names
+}
+
+TOKEN_TERMS = re.compile(
+    r"\b(price|prices|priced|worth|cost|market\s*cap|mcap|volume|supply|ath|all[\s-]time\s+high|fdv|fully\s+diluted)\b",
+    re.IGNORECASE,
+)
+TVL_TERMS = re.compile(r"\b(tvl|total\s+value\s+locked)\b", re.IGNORECASE)
+NEWS_TERMS = re.compile(r"\b(news|headlines|articles)\b", re.IGNORECASE)
+# Questions asking for reasoning or opinions, the LLM picks the tools for those
+OPEN_ENDED_TERMS = re.compile(r"\b(why|should|predict|prediction|forecast|will|explain|opinion|think|better|best)\b", re.IGNORECASE)
+
+ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})(?:-(\d{2}))?\b")
+MONTH_DATE = re.compile(r"\b([a-z]+)\.?\s+(?:(\d{1,2})(?:st|nd|rd|th)?,?\s+)?(\d{4})\b", re.IGNORECASE)
+DAY_MONTH_DATE = re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?\s+([a-z]+)\.?,?\s+(\d{4})\b", re.IGNORECASE)
+YEAR = re.compile(r"\b(?:in|during|of)\s+((?:19|20)\d{2})\b", re.IGNORECASE)
+WORDS = re.compile(r"\$?[A-Za-z][A-Za-z0-9\-]*")
+# Words and the punctuation or numbers between them, which end a name
+TOKENS = re.compile(r"\$?[A-Za-z][A-Za-z0-9\-]*|[^\sA-Za-z]+")
+
+TOKEN_DATA = 'token_data'
+HISTORICAL_PRICE = 'historical_price'
+TVL = 'tvl'
+NEWS = 'news'
+
+
+class Route(NamedTuple):
+    intent: str
+    tool_calls: List[dict]
+    confidence: float
+
+
+def parse_date_period(question: str) -> Optional[str]:
+    """The day, month or year a question refers to, as 'YYYY-MM-DD', 'YYYY-MM' or 'YYYY'."""
+    match = ISO_DATE.search(question)
+    if match:
+        year, month, day = match.groups()
+        return f'{year}-{month}-{day}' if day else f'{year}-{month}'
+
+    for match in DAY_MONTH_DATE.finditer(question):
+        if match.group(2).casefold() in MONTHS:
+            return f'{match.group(3)}-{MONTHS[match.group(2).casefold()]:02d}-{int(match.group(1)):02d}'
+
+    for match in MONTH_DATE.finditer(question):
+        if match.group(1).casefold() in MONTHS:
+            month = MONTHS[match.group(1).casefold()]
+            day = match.group(2)
+            return f'{match.group(3)}-{month:02d}-{int(day):02d}' if day else f'{match.group(3)}-{month:02d}'
+
+    match = YEAR.search(question)
+    return match.group(1) if match else None
+
+
+class IntentRouter:
+    """
+    Rule-based router for structured questions, called before the LLM tool selection.
+
+    Coins and chains are recognized with a gazetteer (COIN_ALIASES plus the DefiLlama chains
+    index), optionally extended with the NER/YAKE keywords of `keywords`. A question gets a
+    route when exactly one intent family matches ("price of ETH", "TVL of Arbitrum", "bitcoin
+    news", "bitcoin's price in May 2014") and its entities resolve; questions that are long,
+    open-ended or refer to the conversation get a low confidence and go through the LLM, and so
+    do questions where a known name may only be part of an unknown one ("bitcoin cash").
+    """
+
+    def __init__(self, chain_lookup: Callable[[str], Optional[dict]] = None, keywords: Callable[[str], List[str]] = None,
+                 min_confidence: float = 0.8, max_words: int = 25, enabled: bool = True):
+        self.chain_lookup = chain_lookup
+        self.keywords = keywords
+        self.min_confidence = min_confidence
+        self.max_words = max_words
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.fallback_seconds = None
+        self.stats = {
+            'routed': 0,
+            'fallback': 0,
+            'failed_routes': 0,
+            'routing_seconds': 0.0,
+            'latency_saved_seconds': 0.0,
+        }
+        self.intent_counts: Dict[str, int] = {}
+
+    # ------------------------------ entities ---------------------------------------
+
+    @staticmethod
+    def candidates(question: str) -> List[str]:
+        """Words and two or three word phrases of the question, in their original case."""
+        words = [word for word in WORDS.findall(question.replace("'s", ""))]
+        phrases = [' '.join(words[start:start + size]) for size in (3, 2) for start in range(len(words) - size + 1)]
+        return phrases + words
+
+    @staticmethod
+    def normalize(candidate: str) -> Optional[str]:
+        # The lookup key of a candidate, None for stopwords and lowercase ambiguous symbols
+        key = candidate.lstrip('$').casefold()
+        if key in STOPWORDS:
+            return None
+        if key in AMBIGUOUS_SYMBOLS and not (candidate.isupper() or candidate.startswith('$')):
+            return None
+        return key
+
+    def resolve_coin(self, candidate: str) -> Optional[str]:
+        key = self.normalize(candidate)
+        if key is None:
+            return None
+        if key in COIN_ALIASES:
+            return COIN_ALIASES[key]
+        chain = self.resolve_chain(candidate)
+        return chain.get('gecko_id') if chain else None
+
+    def resolve_chain(self, candidate: str) -> Optional[dict]:
+        key = self.normalize(candidate)
+        if key is None or self.chain_lookup is None:
+            return None
+        chain = self.chain_lookup(key)
+        if chain is None:
+            return None
+        # Chain names match in any case, token symbols only in capitals or when they are known coin aliases
+        by_name = str(chain.get('name', '')).casefold() == key
+        if not (by_name or candidate.lstrip('$').isupper() or key in COIN_ALIASES):
+            return None
+        return chain
+
+    def entities(self, question: str, resolve: Callable[[str], Optional[object]]) -> List:
+        """Resolved entities in order of appearance, a phrase hiding the words it contains."""
+        found, seen, covered = [], set(), set()
+        candidates = self.candidates(question)
+        if self.keywords is not None:
+            candidates = list(self.keywords(question)) + candidates
+        for candidate in candidates:
+            if candidate.casefold() in covered:
+                continue
+            entity = resolve(candidate)
+            if entity is None:
+                continue
+            identity = entity['name'] if isinstance(entity, dict) else entity
+            if identity not in seen:
+                seen.add(identity)
+                found.append(entity)
+            covered.update(word.casefold() for word in candidate.split())
+        return found
+
+    @staticmethod
+    def name_like(token: str) -> bool:
+        # A word that may be (part of) a name: not a common question word, a month or an intent term
+        key = token.lstrip('$').casefold()
+        if key in NEIGHBOUR_WORDS or key in MONTHS:
+            return False
+        return not any(terms.fullmatch(token) for terms in (TOKEN_TERMS, TVL_TERMS, NEWS_TERMS, OPEN_ENDED_TERMS))
+
+    @staticmethod
+    def scan(question: str, resolve: Callable[[str], Optional[object]]):
+        """
+        Split a question into tokens and resolve its words and phrases, longest first.
+
+        Returns:
+        tuple: The tokens, whether each one is a word, whether each one is part of a resolved
+        entity, and the resolved entities in order of appearance.
+        """
+        tokens = TOKENS.findall(question.replace("'s", ""))
+        words = [WORDS.fullmatch(token) is not None for token in tokens]
+        covered = [False] * len(tokens)
+        found = []
+        for size in (3, 2, 1):
+            for start in range(len(tokens) - size + 1):
+                span = range(start, start + size)
+                if any(covered[index] or not words[index] for index in span):
+                    continue
+                entity = resolve(' '.join(tokens[start:start + size]))
+                if entity is not None:
+                    found.append((start, entity))
+                    for index in span:
+                        covered[index] = True
+        return tokens, words, covered, [entity for _, entity in sorted(found, key=lambda item: item[0])]
+
+    def unknown_neighbours(self, question: str, resolve: Callable[[str], Optional[object]]) -> List[str]:
+        """
+        Name-like words right next to a resolved entity, which may be part of a longer name that
+        does not resolve: "bitcoin cash", "ethereum classic", "wrapped bitcoin".
+        """
+        tokens, words, covered, _ = self.scan(question, resolve)
+        return [
+            token for index, token in enumerate(tokens)
+            if words[index] and not covered[index] and self.name_like(token)
+            and ((index > 0 and covered[index - 1]) or (index + 1 < len(tokens) and covered[index + 1]))
+        ]
+
+    def subject(self, question: str) -> frozenset:
+        """
+        What a question is about: the coins and chains it names, plus the name-like words that do
+        not resolve ("pepe", "cash"), so two questions about different coins never share a subject.
+        """
+        def resolve(candidate: str):
+            coin = self.resolve_coin(candidate)
+            if coin is not None:
+                return coin
+            chain = self.resolve_chain(candidate)
+            return chain['name'] if chain else None
+
+        tokens, words, covered, entities = self.scan(question, resolve)
+        unresolved = [
+            token.lstrip('$').casefold() for index, token in enumerate(tokens)
+            if words[index] and not covered[index] and self.name_like(token)
+        ]
+        return frozenset(entities) | frozenset(unresolved)
+
+    # ------------------------------ routing ----------------------------------------
+
+    def classify(self, question: str) -> Optional[Route]:
+        """Return the best route of a question, with its confidence, or None if no intent matches."""
+        intents = [
+            intent for intent, terms in ((TOKEN_DATA, TOKEN_TERMS), (TVL, TVL_TERMS), (NEWS, NEWS_TERMS))
+            if terms.search(question)
+        ]
+        if not intents:
+            return None
+
+        confidence = 0.95
+        if len(intents) > 1:
+            confidence -= 0.4
+        if OPEN_ENDED_TERMS.search(question) or CONTEXTUAL_TERMS.search(question):
+            confidence -= 0.4
+        if len(question.split()) > self.max_words:
+            confidence -= 0.3
+
+        intent = intents[0]
+        resolve = self.resolve_chain if intent == TVL else self.resolve_coin
+        if self.unknown_neighbours(question, resolve):
+            # The question may be about a coin or chain the gazetteer does not know
+            confidence -= 0.4
+
+        if intent == TVL:
+            chains = self.entities(question, self.resolve_chain)
+            if not chains:
+                return None
+            if len(chains) == 1:
+                return Route(TVL, [{'name': 'get_llama_chains', 'args': {'token_symbol': chains[0]['name']}}], confidence)
+            return Route(TVL, [{'name': 'get_llama_chains_tvl', 'args': {'token_symbols': [chain['name'] for chain in chains]}}], confidence)
+
+        coins = self.entities(question, self.resolve_coin)
+        if not coins:
+            return None
+
+        if intent == NEWS:
+            # The news feed only covers bitcoin
+            if coins != ['bitcoin']:
+                return None
+            return Route(NEWS, [{'name': 'get_latest_bitcoin_news', 'args': {'token_name': 'bitcoin'}}], confidence)
+
+        period = parse_date_period(question)
+        if period is not None:
+            if len(coins) > 1:
+                confidence -= 0.4
+            return Route(HISTORICAL_PRICE, [{'name': 'get_historical_price', 'args': {'coin': coins[0], 'start': period}}], confidence)
+        if len(coins) == 1:
+            return Route(TOKEN_DATA, [{'name': 'get_token_data', 'args': {'coin': coins[0]}}], confidence)
+        return Route(TOKEN_DATA, [{'name': 'get_bulk_token_data', 'args': {'coins': coins}}], confidence)
+
+    def route(self, question: str) -> Optional[Route]:
+        """
+        Route a question, counting it as routed or as a fallback to the LLM tool selection.
+
+        Returns:
+        Optional[Route]: The route when its confidence reaches `min_confidence`, None otherwise.
+        """
+        if not self.enabled:
+            return None
+
+        start = time.perf_counter()
+        try:
+            route = self.classify(question)
+        except Exception as e:
+            print(f'Intent router error: {str(e)}')
+            route = None
+        if route is not None and route.confidence < self.min_confidence:
+            route = None
+
+        with self.lock:
+            self.stats['routing_seconds'] += time.perf_counter() - start
+            if route is None:
+                self.stats['fallback'] += 1
+            else:
+                self.stats['routed'] += 1
+                self.intent_counts[route.intent] = self.intent_counts.get(route.intent, 0) + 1
+                if self.fallback_seconds is not None:
+                    self.stats['latency_saved_seconds'] += self.fallback_seconds
+        return route
+
+    def record_fallback(self, seconds: float, failed_route: bool = False):
+        """
+        Record how long the LLM tool selection took on a fallback, the latency a route saves.
+
+        Parameters:
+        seconds (float): Duration of the LLM tool selection.
+        failed_route (bool): True when a route was taken but its tools returned nothing usable.
+        """
+        with self.lock:
+            if failed_route:
+                # The route ended up costing the tool selection, it counts as a fallback
+                self.stats['routed'] -= 1
+                self.stats['fallback'] += 1
+                self.stats['failed_routes'] += 1
+                if self.fallback_seconds is not None:
+                    self.stats['latency_saved_seconds'] -= self.fallback_seconds
+            # Exponentially weighted, recent calls matter more
+            self.fallback_seconds = seconds if self.fallback_seconds is None else 0.9 * self.fallback_seconds + 0.1 * seconds
+
+    def metrics(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['routed_by_intent'] = dict(self.intent_counts)
+            stats['tool_selection_seconds_avg'] = self.fallback_seconds
+        decisions = stats['routed'] + stats['fallback']
+        stats['enabled'] = self.enabled
+        stats['route_rate'] = stats['routed'] / decisions if decisions else 0.0
+        stats['routing_ms_avg'] = stats['routing_seconds'] * 1000 / decisions if decisions else 0.0
+        return stats
@@ -0,0 +1,182 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import threading
+import requests
+import time
+
+from resilience import RETRY_STATUSES, UpstreamStatusError
+
+LLAMA_CHAINS_URL = "https://api.llama.fi/v2/chains"
+
+
+class LlamaChainsIndex:
+    """
+    Resident index of the DefiLlama `/v2/chains` snapshot.
+
+    Chains are keyed by casefolded token symbol and by casefolded chain name, so lookups are
+    dictionary hits. A daemon thread refreshes the snapshot every `refresh_interval` seconds
+    using the ETag of the previous response, and a lookup refreshes it synchronously when it
+    is older than `max_staleness` seconds. `call`, when given, runs the download `fetch(timeout)`
+    under a resilience policy (e.g. `Upstream.call`), which picks the timeout; otherwise the
+    download gets `timeout`. `rate_limit`, when given, is called with the timeout before every
+    download, may block until the DefiLlama quota allows it, and returns the timeout left.
+    """
+
+    def __init__(self, url: str = LLAMA_CHAINS_URL, refresh_interval: float = 300, max_staleness: float = 900, timeout: float = 10,
+                 rate_limit: Optional[Callable[[float], float]] = None, call: Optional[Callable[[Callable[[float], Any]], Any]] = None):
+        self.url = url
+        self.rate_limit = rate_limit
+        self.call = call
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        self.timeout = timeout
+        self.by_symbol: Dict[str, dict] = {}
+        self.by_name: Dict[str, dict] = {}
+        self.etag = None
+        self.fetched_at = None
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.stats = {'refreshes': 0, 'not_modified': 0, 'refresh_errors': 0, 'collapsed_refreshes': 0, 'lookups': 0}
+
+    @staticmethod
+    def build(chains: List[dict]):
+        """
+        Build the symbol and name dictionaries from a `/v2/chains` payload.
+
+        When several chains share a token symbol the first one of the payload wins,
+        like the sorted linear scan this index replaces.
+        """
+        by_symbol = {}
+        by_name = {}
+        for chain in chains:
+            symbol = chain.get('tokenSymbol')
+            if symbol is not None:
+                by_symbol.setdefault(str(symbol).casefold(), chain)
+            name = chain.get('name')
+            if name is not None:
+                by_name.setdefault(str(name).casefold(), chain)
+        return by_symbol, by_name
+
+    def load(self, chains: List[dict], etag: Optional[str] = None):
+        by_symbol, by_name = self.build(chains)
+        with self.lock:
+            self.by_symbol = by_symbol
+            self.by_name = by_name
+            self.etag = etag
+            self.fetched_at = time.monotonic()
+
+    def refresh(self, max_age: Optional[float] = None) -> bool:
+        """
+        Download the chains snapshot, sending the previous ETag.
+
+        Parameters:
+        max_age (Optional[float]): Skip the download if another thread refreshed the snapshot
+        within `max_age` seconds while this one was waiting, so a burst of lookups on a stale
+        index costs a single request.
+
+        Returns:
+        bool: True if the index holds a snapshot after the refresh.
+        """
+        with self.refresh_lock:
+            age = self.age()
+            if max_age is not None and age is not None and age <= max_age:
+                with self.lock:
+                    self.stats['collapsed_refreshes'] += 1
+                return True
+
+            headers = {'If-None-Match': self.etag} if self.etag else {}
+
+            def fetch(timeout: float):
+                if self.rate_limit is not None:
+                    timeout = self.rate_limit(timeout)
+                response = requests.get(self.url, headers=headers, timeout=timeout)
+                if response.status_code in RETRY_STATUSES:
+                    raise UpstreamStatusError(response.status_code)
+                return response
+
+            try:
+                response = fetch(self.timeout) if self.call is None else self.call(fetch)
+                if response.status_code == 304:
+                    with self.lock:
+                        self.fetched_at = time.monotonic()
+                        self.stats['not_modified'] += 1
+                    return True
+                response.raise_for_status()
+                self.load(response.json(), response.headers.get('ETag'))
+                with self.lock:
+                    self.stats['refreshes'] += 1
+                return True
+            except Exception as e:
+                print(f'DefiLlama chains refresh error: {str(e)}')
+                with self.lock:
+                    self.stats['refresh_errors'] += 1
+                return self.fetched_at is not None
+
+    def age(self) -> Optional[float]:
+        return None if self.fetched_at is None else time.monotonic() - self.fetched_at
+
+    def ensure_fresh(self) -> bool:
+        """Start the background refresh and reload synchronously if the snapshot is missing or too old."""
+        self.start()
+        age = self.age()
+        if age is None or age > self.max_staleness:
+            return self.refresh(max_age=self.max_staleness)
+        return True
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='llama-chains-refresh', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def after_fork(self):
+        """Threads do not survive a fork, the next `start` in the child starts its own refresh thread."""
+        self.thread = None
+
+    def _run(self):
+        while not self.stopped.wait(self.refresh_interval):
+            self.refresh()
+
+    def lookup(self, token_symbol: str) -> Optional[dict]:
+        """
+        Find a chain by token symbol, falling back to the chain name.
+
+        Parameters:
+        token_symbol (str): The token symbol (or chain name) to search for.
+
+        Returns:
+        Optional[dict]: The chain entry of the snapshot, or None if not found.
+        """
+        key = str(token_symbol).casefold()
+        with self.lock:
+            self.stats['lookups'] += 1
+            return self.by_symbol.get(key) or self.by_name.get(key)
+
+    def bulk_tvl(self, token_symbols: Iterable[str]) -> Dict[str, Optional[dict]]:
+        """
+        Look up the TVL of many token symbols against the same snapshot.
+
+        Parameters:
+        token_symbols (Iterable[str]): The token symbols (or chain names) to search for.
+
+        Returns:
+        dict: The chain name and TVL per requested symbol, None for symbols not found.
+        """
+        result = {}
+        for token_symbol in token_symbols:
+            chain = self.lookup(token_symbol)
+            result[token_symbol] = {'name': chain['name'], 'tvl': chain['tvl']} if chain else None
+        return result
+
+    def metrics(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['chains'] = len(self.by_name)
+        stats['age_seconds'] = self.age()
+        return stats
@@ -0,0 +1,242 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+import calendar
+import threading
+import glob
+import os
+
+PRICE_STORE_MAX_PARTS = 8
+
+
+def parse_period(period: str) -> Tuple[date, date]:
+    """
+    Parse 'YYYY-MM-DD', 'YYYY-MM' or 'YYYY' into the first and last day it covers.
+
+    Parameters:
+    period (str): The date, month or year.
+
+    Returns:
+    tuple: The first and last day, both included.
+    """
+    parts = str(period).strip().split('-')
+    year = int(parts[0])
+    if len(parts) == 1:
+        return date(year, 1, 1), date(year, 12, 31)
+    month = int(parts[1])
+    if len(parts) == 2:
+        return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+    day = date(year, month, int(parts[2]))
+    return day, day
+
+
+def parse_market_chart(chart: dict, until: date) -> Dict[date, dict]:
+    """
+    Turn a CoinGecko `/coins/{id}/market_chart?interval=daily` payload into one row per UTC day.
+
+    Points are stamped at midnight UTC, days after `until` (e.g. today's partial point) are dropped.
+    """
+    rows: Dict[date, dict] = {}
+    for column, key in (('price', 'prices'), ('market_cap', 'market_caps'), ('total_volume', 'total_volumes')):
+        for timestamp, value in chart.get(key) or []:
+            day = datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc).date()
+            if day <= until:
+                rows.setdefault(day, {'date': day, 'price': None, 'market_cap': None, 'total_volume': None})[column] = value
+    return rows
+
+
+class PriceStore:
+    """
+    Local daily price, market cap and volume history, one Parquet dataset per coin.
+
+    Each ingestion only requests the days after the last stored one and appends them as a
+    new part file, parts are compacted once there are more than `max_parts`. Reads memory-map
+    the part files and keep the table of each coin in memory until its files change, so
+    queries never touch the network.
+    """
+
+    def __init__(self, directory: str, get_json: Optional[Callable] = None, base_url: Optional[str] = None,
+                 headers: Optional[Dict[str, str]] = None, max_parts: int = PRICE_STORE_MAX_PARTS):
+        self.directory = directory
+        self.get_json = get_json
+        self.base_url = base_url
+        self.headers = headers
+        self.max_parts = max_parts
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.ingest_lock = threading.Lock()
+
+    def _coin_directory(self, coin_id: str) -> str:
+        return os.path.join(self.directory, coin_id)
+
+    def _parts(self, coin_id: str) -> List[str]:
+        return sorted(glob.glob(os.path.join(self._coin_directory(coin_id), 'part-*.parquet')))
+
+    def coins(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if self._parts(name))
+
+    def table(self, coin_id: str):
+        """The stored history of a coin as a pyarrow Table sorted by date, None if there is none."""
+        # Deferred import, pyarrow is only needed once a price question comes in
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        parts = self._parts(coin_id)
+        if not parts:
+            return None
+        signature = tuple((part, os.path.getmtime(part)) for part in parts)
+
+        with self.lock:
+            cached = self.tables.get(coin_id)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+
+        table = pa.concat_tables([pq.read_table(part, memory_map=True) for part in parts])
+        table = table.sort_by('date')
+        with self.lock:
+            self.tables[coin_id] = (signature, table)
+        return table
+
+    def last_date(self, coin_id: str) -> Optional[date]:
+        import pyarrow.compute as pc
+
+        table = self.table(coin_id)
+        if table is None or table.num_rows == 0:
+            return None
+        return pc.max(table['date']).as_py()
+
+    def append(self, coin_id: str, rows: List[dict]):
+        """Write `rows` (dicts with date, price, market_cap and total_volume) as a new part file of the coin."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not rows:
+            return
+        rows = sorted(rows, key=lambda row: row['date'])
+        table = pa.table({
+            'date': pa.array([row['date'] for row in rows], type=pa.date32()),
+            'price': pa.array([row['price'] for row in rows], type=pa.float64()),
+            'market_cap': pa.array([row['market_cap'] for row in rows], type=pa.float64()),
+            'total_volume': pa.array([row['total_volume'] for row in rows], type=pa.float64()),
+        })
+
+        coin_directory = self._coin_directory(coin_id)
+        os.makedirs(coin_directory, exist_ok=True)
+        path = os.path.join(coin_directory, f"part-{rows[0]['date']:%Y%m%d}-{rows[-1]['date']:%Y%m%d}.parquet")
+        # Written aside then renamed, readers never see a partial file
+        pq.write_table(table, f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+
+        if len(self._parts(coin_id)) > self.max_parts:
+            self.compact(coin_id)
+
+    def compact(self, coin_id: str):
+        """Merge the part files of a coin into one, keeping the latest row of each day."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        parts = self._parts(coin_id)
+        if len(parts) <= 1:
+            return
+        frame = pa.concat_tables([pq.read_table(part, memory_map=True) for part in parts]).to_pandas()
+        frame = frame.drop_duplicates('date', keep='last').sort_values('date')
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+
+        path = os.path.join(self._coin_directory(coin_id), f"part-{frame['date'].iloc[0]:%Y%m%d}-{frame['date'].iloc[-1]:%Y%m%d}.parquet")
+        pq.write_table(table, f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+        for part in parts:
+            if part != path:
+                os.remove(part)
+
+    def ingest(self, coin_id: str, today: Optional[date] = None) -> int:
+        """
+        Fetch and append the days missing since the last stored one, up to yesterday (UTC).
+
+        Parameters:
+        coin_id (str): The CoinGecko ID of the coin.
+        today (Optional[date]): The current UTC day, for backfills and tests.
+
+        Returns:
+        int: The number of days appended.
+        """
+        if self.get_json is None:
+            raise ValueError("PriceStore needs get_json and base_url to ingest")
+
+        today = today or datetime.now(timezone.utc).date()
+        until = today - timedelta(days=1)
+        with self.ingest_lock:
+            last = self.last_date(coin_id)
+            if last is not None and last >= until:
+                return 0
+
+            days = 'max' if last is None else str((today - last).days)
+            status, chart = self.get_json(
+                f'{self.base_url}/coins/{coin_id}/market_chart',
+                headers=self.headers,
+                params={'vs_currency': 'usd', 'days': days, 'interval': 'daily'},
+            )
+            if status != 200:
+                raise ValueError(f"CoinGecko market chart of {coin_id} returned HTTP {status}")
+
+            rows = [row for day, row in parse_market_chart(chart, until).items() if last is None or day > last]
+            self.append(coin_id, rows)
+            return len(rows)
+
+    def price_on(self, coin_id: str, day: date) -> Optional[dict]:
+        """The stored row of `day`, None when the coin or the day is not stored."""
+        import pyarrow.compute as pc
+
+        table = self.table(coin_id)
+        if table is None:
+            return None
+        rows = table.filter(pc.equal(table['date'], day)).to_pylist()
+        if not rows:
+            return None
+        return {**rows[-1], 'date': day.isoformat()}
+
+    def price_range(self, coin_id: str, start: date, end: date) -> Optional[dict]:
+        """Min, max and average price and market cap over `start`..`end` (both included)."""
+        import pyarrow.compute as pc
+
+        table = self.table(coin_id)
+        if table is None:
+            return None
+        window = table.filter(pc.and_(pc.greater_equal(table['date'], start), pc.less_equal(table['date'], end)))
+        if window.num_rows == 0:
+            return None
+
+        prices = pc.min_max(window['price']).as_py()
+        market_caps = pc.min_max(window['market_cap']).as_py()
+        return {
+            'days': window.num_rows,
+            'first_date': window['date'][0].as_py().isoformat(),
+            'last_date': window['date'][-1].as_py().isoformat(),
+            'price_open': window['price'][0].as_py(),
+            'price_close': window['price'][-1].as_py(),
+            'price_min': prices['min'],
+            'price_max': prices['max'],
+            'price_avg': pc.mean(window['price']).as_py(),
+            'market_cap_min': market_caps['min'],
+            'market_cap_max': market_caps['max'],
+            'market_cap_avg': pc.mean(window['market_cap']).as_py(),
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Update the local daily price history")
+    parser.add_argument('command', choices=['ingest', 'compact'])
+    parser.add_argument('coins', nargs='*', help="CoinGecko IDs, every stored coin by default")
+    args = parser.parse_args()
+
+    # The store configured in index.py, with its CoinGecko credentials and shared request layer
+    from index import price_store
+
+    for coin_id in args.coins or price_store.coins():
+        if args.command == 'ingest':
+            print(f"{coin_id}: {price_store.ingest(coin_id)} days appended")
+        else:
+            price_store.compact(coin_id)
@@ -0,0 +1,290 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, List, Mapping, Optional, Tuple
+import threading
+import random
+import json
+import time
+import sys
+import os
+
+COLLAPSED = 'collapsed'
+SPEEDSCOPE = 'speedscope'
+FORMATS = (COLLAPSED, SPEEDSCOPE)
+EXTENSIONS = {COLLAPSED: 'collapsed.txt', SPEEDSCOPE: 'speedscope.json'}
+
+# File name of the profile written for the current request, None when it is not profiled
+profile_file: ContextVar[Optional[str]] = ContextVar('profile_file', default=None)
+
+# Profile of the current request, carried into pool threads by `submit_in_context`
+active_profile: ContextVar[Optional['Profile']] = ContextVar('active_profile', default=None)
+
+
+def frame_label(code) -> Tuple[str, str, int]:
+    return code.co_name, code.co_filename, code.co_firstlineno
+
+
+class Profile:
+    """
+    Sampling profile of one request, taken by a daemon thread every `interval` seconds.
+
+    The thread that started the profile is sampled at every tick, so waits on upstreams show
+    up as wall time. Pool threads are only sampled while they work for this request, inside
+    `profile_thread` (e.g. the tool calls): their stacks are rooted at the thread name. Work
+    the request hands to other pools is not sampled, and in the asyncio serving mode the
+    request's thread is the event loop, whose samples include the other requests it serves.
+    The profile is written by the sampling thread once `stop` is called, so the request does
+    not wait for the file.
+    """
+
+    def __init__(self, path: str, fmt: str = COLLAPSED, interval: float = 0.005, max_seconds: float = 120.0,
+                 on_done=None):
+        self.path = path
+        self.format = fmt
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.on_done = on_done
+        self.target = threading.get_ident()
+        self.threads: Dict[int, int] = {}
+        self.threads_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.labels: Dict[object, Tuple[str, str, int]] = {}
+        self.samples: List[Tuple[str, Tuple[Tuple[str, str, int], ...], float]] = []
+        self.started_at = None
+        self.duration = 0.0
+        self.thread = threading.Thread(target=self._run, name='penelope-profiler', daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def add_thread(self, ident: int):
+        with self.threads_lock:
+            self.threads[ident] = self.threads.get(ident, 0) + 1
+
+    def remove_thread(self, ident: int):
+        with self.threads_lock:
+            if self.threads[ident] == 1:
+                del self.threads[ident]
+            else:
+                self.threads[ident] -= 1
+
+    def _stack(self, frame) -> Tuple[Tuple[str, str, int], ...]:
+        # Root first, the label of each code object is built once
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            label = self.labels.get(code)
+            if label is None:
+                label = self.labels[code] = frame_label(code)
+            stack.append(label)
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def _sample(self, weight: float):
+        with self.threads_lock:
+            sampled = {self.target, *self.threads}
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident not in sampled:
+                continue
+            name = 'request' if ident == self.target else names.get(ident, f'thread-{ident}')
+            self.samples.append((name, self._stack(frame), weight))
+
+    def _run(self):
+        end = self.started_at + self.max_seconds
+        last = self.started_at
+        try:
+            while not self.stopped.wait(self.interval):
+                now = time.perf_counter()
+                self._sample(now - last)
+                last = now
+                if now >= end:
+                    break
+            self.duration = time.perf_counter() - self.started_at
+            self.write()
+        except Exception as e:
+            print(f'Profiler error: {str(e)}')
+        finally:
+            if self.on_done is not None:
+                self.on_done(self)
+
+    def write(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        content = self.speedscope() if self.format == SPEEDSCOPE else self.collapsed()
+        # Written under a temporary name, a half-written profile is never picked up
+        partial = f'{self.path}.partial'
+        with open(partial, 'w') as file:
+            file.write(content)
+        os.replace(partial, self.path)
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed stacks, one `thread;frame;...;frame count` line per distinct stack."""
+        counts: Dict[str, int] = {}
+        for name, stack, _ in self.samples:
+            line = ';'.join([name] + [f'{function} ({os.path.basename(file)}:{line})' for function, file, line in stack])
+            counts[line] = counts.get(line, 0) + 1
+        return ''.join(f'{line} {count}\n' for line, count in counts.items())
+
+    def speedscope(self) -> str:
+        """A speedscope file (https://www.speedscope.app) with one sampled profile per thread, weighted in seconds."""
+        frames, indexes = [], {}
+        profiles: Dict[str, dict] = {}
+        for name, stack, weight in self.samples:
+            sample = []
+            for label in stack:
+                index = indexes.get(label)
+                if index is None:
+                    index = indexes[label] = len(frames)
+                    function, file, line = label
+                    frames.append({'name': function, 'file': file, 'line': line})
+                sample.append(index)
+            profile = profiles.setdefault(name, {
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': self.duration,
+                'samples': [],
+                'weights': [],
+            })
+            profile['samples'].append(sample)
+            profile['weights'].append(weight)
+        ordered = sorted(profiles.values(), key=lambda profile: profile['name'] != 'request')
+        return json.dumps({
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': os.path.basename(self.path),
+            'exporter': 'penelope',
+            'activeProfileIndex': 0,
+            'shared': {'frames': frames},
+            'profiles': ordered,
+        })
+
+
+@contextmanager
+def profile_thread():
+    """Sample the current thread while the enclosed block works for the profiled request, if any."""
+    profile = active_profile.get()
+    if profile is None:
+        yield
+        return
+    ident = threading.get_ident()
+    profile.add_thread(ident)
+    try:
+        yield
+    finally:
+        profile.remove_thread(ident)
+
+
+class Profiler:
+    """
+    Opt-in profiling of single requests, requested with a header or picked at `sample_rate`.
+
+    When `enabled` is False, `profile` returns a shared `nullcontext` without looking at the
+    request, so a disabled profiler costs one attribute check. At most `max_concurrent`
+    profiles run at once, further requests are served unprofiled.
+    """
+
+    def __init__(self, directory: str, enabled: bool = False, header: str = 'X-Profile', sample_rate: float = 0.0,
+                 fmt: str = COLLAPSED, interval: float = 0.005, max_seconds: float = 120.0, max_concurrent: int = 2):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown profile format {fmt!r}, expected one of {', '.join(FORMATS)}")
+        self.directory = directory
+        self.enabled = enabled
+        self.header = header
+        self.sample_rate = sample_rate
+        self.format = fmt
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.max_concurrent = max_concurrent
+        self.lock = threading.Lock()
+        self.running = 0
+        self.disabled = nullcontext()
+        self.stats = {
+            'profiles': 0,
+            'requested': 0,
+            'sampled': 0,
+            'skipped': 0,
+            'samples': 0,
+        }
+
+    def requested_format(self, headers: Mapping[str, str]) -> Optional[str]:
+        """The format asked for by the profiling header ('1', 'true' or a format name), None when absent."""
+        value = (headers.get(self.header) or '').strip().lower()
+        if value in FORMATS:
+            return value
+        if value in ('1', 'true', 'yes'):
+            return self.format
+        return None
+
+    def profile(self, headers: Mapping[str, str], name: Optional[str] = None):
+        """
+        Profile the enclosed block when the request asks for it or is sampled.
+
+        Parameters:
+        headers (Mapping[str, str]): The request headers.
+        name (Optional[str]): Identifies the file, e.g. the trace ID, a random ID when None.
+        """
+        if not self.enabled:
+            return self.disabled
+        fmt = self.requested_format(headers)
+        reason = 'requested'
+        if fmt is None:
+            if not (self.sample_rate and random.random() < self.sample_rate):
+                return self.disabled
+            fmt, reason = self.format, 'sampled'
+        return self._profile(fmt, reason, name)
+
+    @contextmanager
+    def _profile(self, fmt: str, reason: str, name: Optional[str]):
+        with self.lock:
+            if self.running >= self.max_concurrent:
+                self.stats['skipped'] += 1
+                profile = None
+            else:
+                self.running += 1
+                self.stats[reason] += 1
+                profile = self._create(fmt, name)
+        if profile is None:
+            yield
+            return
+
+        # Left set for the response header, the app clears it when the request ends
+        profile_file.set(os.path.basename(profile.path))
+        token = active_profile.set(profile)
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            active_profile.reset(token)
+
+    def _create(self, fmt: str, name: Optional[str]) -> Profile:
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        file_name = f"{stamp}-{name or os.urandom(4).hex()}.{EXTENSIONS[fmt]}"
+        return Profile(
+            os.path.join(self.directory, file_name),
+            fmt,
+            interval=self.interval,
+            max_seconds=self.max_seconds,
+            on_done=self._done,
+        )
+
+    def _done(self, profile: Profile):
+        with self.lock:
+            self.running -= 1
+            self.stats['profiles'] += 1
+            self.stats['samples'] += len(profile.samples)
+
+    def metrics(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['running'] = self.running
+        stats['enabled'] = self.enabled
+        stats['sample_rate'] = self.sample_rate
+        return stats
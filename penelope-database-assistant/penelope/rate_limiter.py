@@ -0,0 +1,262 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+import contextvars
+import itertools
+import threading
+import asyncio
+import sqlite3
+import heapq
+import time
+import os
+
+# Imported as `rate_limiter` by the API, which runs from this directory, and as
+# `penelope.rate_limiter` by the services, which run from the project root
+try:
+    from .resilience import LatencyTracker
+except ImportError:
+    from resilience import LatencyTracker
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+# Priority of the upstream requests made in the current context, background unless a user is waiting
+request_priority: ContextVar[int] = ContextVar('request_priority', default=BACKGROUND)
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+@contextmanager
+def priority(level: int):
+    """Run the enclosed upstream requests at `level` (INTERACTIVE or BACKGROUND)."""
+    token = request_priority.set(level)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+
+class TokenBucketStore:
+    """
+    Token buckets kept in a SQLite file, shared by every worker process on the host.
+
+    A bucket holds up to `capacity` tokens and refills at `rate` tokens per second. Each take
+    is one short write transaction, which SQLite serializes across processes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.initialized = False
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, opened on first use
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with self.lock:
+                if not self.initialized:
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+                    )
+                    self.initialized = True
+            self.local.connection = connection
+        return connection
+
+    def take(self, name: str, rate: float, capacity: float, reserve: float = 0.0) -> float:
+        """
+        Take one token if at least `1 + reserve` are available.
+
+        Returns:
+        float: 0 when the token was taken, otherwise the seconds until enough tokens are back.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = connection.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + max(now - row[1], 0) * rate)
+            if tokens >= 1 + reserve:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 + reserve - tokens) / rate
+            connection.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)", (name, tokens, now))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+    def after_fork(self):
+        """Forget the connections inherited from the parent process, SQLite connections must not cross a fork."""
+        self.local = threading.local()
+
+    def drain(self, name: str):
+        """Empty a bucket, every process then waits for it to refill."""
+        self._connection().execute(
+            "INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, 0, ?)", (name, time.time())
+        )
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter of one upstream quota, with a priority queue of waiters.
+
+    Within a process, waiters are served by priority, then in arrival order: only the head of
+    the queue takes from the shared bucket. Across processes, background requests leave the
+    last `reserve` fraction of the bucket to interactive ones, so cache refreshes cannot use up
+    the quota a user is waiting on. Store errors let the request through.
+    """
+
+    def __init__(self, name: str, store: TokenBucketStore, per_minute: float, burst: Optional[float] = None,
+                 reserve: float = 0.2, max_wait: float = 30.0, enabled: bool = True, async_waiters: int = 32):
+        self.name = name
+        self.store = store
+        self.rate = per_minute / 60
+        self.capacity = burst if burst is not None else max(per_minute / 10, 1)
+        self.reserve = reserve * self.capacity
+        self.max_wait = max_wait
+        self.enabled = enabled
+        self.async_waiters = async_waiters
+        self.executor = None
+        self.condition = threading.Condition()
+        self.queue = []
+        self.sequence = itertools.count()
+        self.wait_times = {level: LatencyTracker(min_samples=1) for level in PRIORITY_NAMES}
+        self.stats = {
+            'acquired': {name: 0 for name in PRIORITY_NAMES.values()},
+            'waited': {name: 0 for name in PRIORITY_NAMES.values()},
+            'wait_seconds': {name: 0.0 for name in PRIORITY_NAMES.values()},
+            'timeouts': 0,
+            'drained': 0,
+            'store_errors': 0,
+        }
+
+    def acquire(self, level: Optional[int] = None, timeout: Optional[float] = None) -> float:
+        """
+        Wait for a token of the quota.
+
+        Parameters:
+        level (Optional[int]): INTERACTIVE or BACKGROUND, the context's `request_priority` when None.
+        timeout (Optional[float]): Longest wait, `max_wait` when None.
+
+        Returns:
+        float: The seconds spent waiting.
+
+        Raises:
+        RateLimitTimeout: When no token was available in time.
+        """
+        if not self.enabled:
+            return 0.0
+        level = request_priority.get() if level is None else level
+        timeout = self.max_wait if timeout is None else min(timeout, self.max_wait)
+        start = time.monotonic()
+        end = start + timeout
+        entry = (level, next(self.sequence))
+
+        with self.condition:
+            heapq.heappush(self.queue, entry)
+            self.condition.notify_all()
+        try:
+            while True:
+                with self.condition:
+                    while self.queue[0] is not entry:
+                        left = end - time.monotonic()
+                        if left <= 0:
+                            raise self._timeout(timeout)
+                        self.condition.wait(left)
+
+                # Only the head of the queue takes from the shared bucket, outside the lock
+                wait = self._take(level)
+                if wait == 0:
+                    break
+                left = end - time.monotonic()
+                if left <= 0:
+                    raise self._timeout(timeout)
+                # Woken early when a waiter arrives, in case it has a higher priority
+                with self.condition:
+                    self.condition.wait(min(wait, left))
+        finally:
+            with self.condition:
+                self.queue.remove(entry)
+                heapq.heapify(self.queue)
+                self.condition.notify_all()
+
+        waited = time.monotonic() - start
+        self._record(level, waited)
+        return waited
+
+    async def aacquire(self, level: Optional[int] = None, timeout: Optional[float] = None) -> float:
+        """Async variant of `acquire`, the wait runs on a dedicated thread pool to keep the default executor free."""
+        if not self.enabled:
+            return 0.0
+        level = request_priority.get() if level is None else level
+        with self.condition:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.async_waiters, thread_name_prefix=f'{self.name}-rate-limit')
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, contextvars.copy_context().run, self.acquire, level, timeout)
+
+    def _take(self, level: int) -> float:
+        try:
+            return self.store.take(self.name, self.rate, self.capacity, self.reserve if level == BACKGROUND else 0.0)
+        except sqlite3.Error as e:
+            print(f'{self.name} rate limit store error: {str(e)}')
+            with self.condition:
+                self.stats['store_errors'] += 1
+            return 0.0
+
+    def _timeout(self, timeout: float) -> RateLimitTimeout:
+        with self.condition:
+            self.stats['timeouts'] += 1
+        return RateLimitTimeout(f"No {self.name} quota available within {timeout}s")
+
+    def _record(self, level: int, waited: float):
+        name = PRIORITY_NAMES[level]
+        self.wait_times[level].record(waited)
+        with self.condition:
+            self.stats['acquired'][name] += 1
+            self.stats['wait_seconds'][name] += waited
+            # Under a millisecond is the cost of the store itself, not a wait
+            if waited > 0.001:
+                self.stats['waited'][name] += 1
+
+    def drain(self):
+        """Empty the shared bucket, e.g. after the upstream answered 429."""
+        if not self.enabled:
+            return
+        try:
+            self.store.drain(self.name)
+        except sqlite3.Error as e:
+            print(f'{self.name} rate limit store error: {str(e)}')
+        with self.condition:
+            self.stats['drained'] += 1
+
+    def metrics(self) -> dict:
+        with self.condition:
+            stats = {
+                key: dict(value) if isinstance(value, dict) else value
+                for key, value in self.stats.items()
+            }
+            stats['queue_depth'] = len(self.queue)
+        for level, name in PRIORITY_NAMES.items():
+            tracker = self.wait_times[level]
+            p50, p95, p99 = (tracker.quantile(q) for q in (0.5, 0.95, 0.99))
+            stats.setdefault('wait_ms', {})[name] = {
+                'p50': p50 * 1000 if p50 is not None else None,
+                'p95': p95 * 1000 if p95 is not None else None,
+                'p99': p99 * 1000 if p99 is not None else None,
+            }
+        stats['per_minute'] = self.rate * 60
+        stats['burst'] = self.capacity
+        stats['enabled'] = self.enabled
+        return stats
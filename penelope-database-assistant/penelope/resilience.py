@@ -0,0 +1,465 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional, Tuple, Type
+import contextvars
+import threading
+import asyncio
+import random
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Statuses worth retrying: rate limits and server errors
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Absolute time.monotonic() by which the current request must be answered, None without a budget.
+# Asyncio tasks and `asyncio.to_thread` inherit it, thread pool submissions go through `submit_in_context`
+request_deadline: ContextVar[Optional[float]] = ContextVar('request_deadline', default=None)
+
+
+class UpstreamError(Exception):
+    """Base class of the errors raised by `Upstream` instead of calling the upstream."""
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class DeadlineExceeded(UpstreamError):
+    pass
+
+
+class UpstreamBusy(UpstreamError):
+    pass
+
+
+class UpstreamStatusError(Exception):
+    """A retryable HTTP status, raised by request functions so `Upstream` retries them."""
+
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    """
+    The HTTP status of the upstream response an error was raised for, None when it carries none.
+
+    Reads `status` (aiohttp, `UpstreamStatusError`), `http_status` (Abacus.AI SDK) or
+    `response.status_code` (requests).
+    """
+    for attribute in ('status', 'http_status', 'status_code'):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+@contextmanager
+def deadline(seconds: Optional[float]):
+    """
+    Give the enclosed stages `seconds` to finish, or keep the enclosing deadline if it is sooner.
+
+    Parameters:
+    seconds (Optional[float]): The budget of the stage, None for no budget.
+    """
+    current = request_deadline.get()
+    if seconds is not None:
+        candidate = time.monotonic() + seconds
+        current = candidate if current is None else min(current, candidate)
+    token = request_deadline.set(current)
+    try:
+        yield
+    finally:
+        request_deadline.reset(token)
+
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left before the request deadline, `default` when there is none."""
+    current = request_deadline.get()
+    if current is None:
+        return default
+    return current - time.monotonic()
+
+
+def submit_in_context(executor: ThreadPoolExecutor, fn: Callable, *args, **kwargs):
+    """`executor.submit` that carries the request deadline (and any other context variable) to the worker."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def stage_timeout(timeout: float) -> float:
+    """`timeout` capped by the request deadline."""
+    left = remaining()
+    return timeout if left is None else max(min(timeout, left), 0.0)
+
+
+class BlockingCallPool:
+    """
+    Thread pool for the blocking calls of a client that has no timeout of its own.
+
+    `run` waits for a call up to its timeout. A call still queued by then is cancelled, one
+    already running cannot be interrupted and is abandoned to its worker until the client
+    returns. At most `max_abandoned` abandoned calls are tolerated: past that, `run` raises
+    `UpstreamBusy` without queueing the call, so hung calls never hold every worker and at
+    least `max_workers - max_abandoned` are left to the calls that can still be answered.
+    """
+
+    def __init__(self, max_workers: int, max_abandoned: Optional[int] = None, name: str = 'blocking'):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_abandoned = max(max_workers // 2, 1) if max_abandoned is None else max_abandoned
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.lock = threading.Lock()
+        self.abandoned = 0
+        self.stats = {
+            'calls': 0,
+            'cancelled': 0,
+            'abandoned': 0,
+            'rejected': 0,
+        }
+
+    def run(self, timeout: Optional[float], fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run `fn(*args, **kwargs)` on the pool and wait up to `timeout` seconds for its result.
+
+        Raises:
+        UpstreamBusy: When `max_abandoned` calls that timed out are still running.
+        concurrent.futures.TimeoutError: When the call did not return in time.
+        """
+        with self.lock:
+            if self.abandoned >= self.max_abandoned:
+                self.stats['rejected'] += 1
+                raise UpstreamBusy(f"{self.abandoned} {self.name} calls that timed out are still running")
+            self.stats['calls'] += 1
+
+        future = self.executor.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                with self.lock:
+                    self.stats['cancelled'] += 1
+            else:
+                with self.lock:
+                    self.abandoned += 1
+                    self.stats['abandoned'] += 1
+                # Called right away if the call returned in the meantime
+                future.add_done_callback(self._released)
+            raise
+
+    def _released(self, future):
+        with self.lock:
+            self.abandoned -= 1
+
+    def after_fork(self):
+        """Threads do not survive a fork, the child starts with no abandoned calls."""
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        self.lock = threading.Lock()
+        self.abandoned = 0
+
+    def metrics(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['running_abandoned'] = self.abandoned
+        stats['max_workers'] = self.max_workers
+        stats['max_abandoned'] = self.max_abandoned
+        return stats
+
+
+class CircuitBreaker:
+    """
+    Fail fast while an upstream is down.
+
+    The circuit opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds. It then lets a single trial call through (half open): a success
+    closes it, a failure opens it again, and a trial without a verdict lets the next call try.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started = 0.0
+        self.opened = 0
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self.trial_started = 0.0
+            # A trial that never reported back (e.g. cancelled) is replaced after reset_timeout
+            if self.state == HALF_OPEN and now - self.trial_started >= self.reset_timeout:
+                self.trial_started = now
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def release(self):
+        # The call neither succeeded nor failed: leave the state alone, free the trial if any
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.trial_started = 0.0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opened += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Durations of the latest successful calls, for the hedging delay."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class Upstream:
+    """
+    Resilience policy of one upstream service, shared by all of its endpoints.
+
+    `call`/`acall` run a request function that takes its timeout in seconds. Every attempt gets
+    the endpoint timeout capped by the request deadline (see `deadline`); failures listed in
+    `retry_on` are retried with full-jitter exponential backoff while the deadline allows;
+    idempotent calls still running after the `hedge_quantile` latency get a duplicate request
+    and the first success wins; and a circuit breaker rejects calls with `CircuitOpenError`
+    while the upstream keeps failing, so callers can answer with degraded data right away.
+    Other errors count against the circuit when `is_failure` says so (e.g. the server errors
+    of an SDK), without being retried. Of the rest, 4xx responses (see `error_status`) are the
+    caller's and count as answers, and any other error (e.g. a bug in the request function)
+    says nothing about the upstream and leaves the circuit alone.
+    """
+
+    def __init__(self, name: str, timeout: float = 10.0, retries: int = 2, backoff: float = 0.2, max_backoff: float = 2.0,
+                 hedge: bool = False, hedge_quantile: float = 0.95, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 retry_on: Tuple[Type[BaseException], ...] = (UpstreamStatusError, ConnectionError, TimeoutError,
+                                                              asyncio.TimeoutError, FutureTimeoutError),
+                 is_failure: Optional[Callable[[BaseException], bool]] = None, executor: Optional[ThreadPoolExecutor] = None):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.retry_on = retry_on
+        self.is_failure = is_failure
+        self.executor = executor
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latency = LatencyTracker()
+        self.lock = threading.Lock()
+        self.stats = {
+            'calls': 0,
+            'successes': 0,
+            'errors': 0,
+            'failures': 0,
+            'retries': 0,
+            'hedges': 0,
+            'hedge_wins': 0,
+            'short_circuits': 0,
+            'deadline_exceeded': 0,
+        }
+
+    def _count(self, stat: str):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def _before_attempt(self, attempt: int) -> float:
+        # The timeout of the next attempt, or raise when the budget or the circuit says no
+        if attempt == 0:
+            self._count('calls')
+            if not self.breaker.allow():
+                self._count('short_circuits')
+                raise CircuitOpenError(f"{self.name} circuit is open")
+        timeout = stage_timeout(self.timeout)
+        if timeout <= 0:
+            self._count('deadline_exceeded')
+            raise DeadlineExceeded(f"No time left to call {self.name}")
+        return timeout
+
+    def _backoff(self, attempt: int) -> Optional[float]:
+        # Full jitter, None when the deadline leaves no room for another attempt
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        left = remaining()
+        if left is not None and left <= delay:
+            return None
+        return delay
+
+    def _hedge_delay(self, idempotent: bool, timeout: float) -> Optional[float]:
+        if not (self.hedge and idempotent):
+            return None
+        delay = self.latency.quantile(self.hedge_quantile)
+        return delay if delay is not None and delay < timeout else None
+
+    def _failed(self, error: BaseException, attempt: int) -> Optional[float]:
+        # Record a failed attempt; the backoff before the next one, None to give up
+        if not isinstance(error, self.retry_on):
+            if self.is_failure is not None and self.is_failure(error):
+                # The upstream is failing, but retrying would not help
+                self.breaker.record_failure()
+                self._count('failures')
+                return None
+            status = error_status(error)
+            if status is not None and 400 <= status < 500:
+                # The upstream did answer, the error is the caller's
+                self.breaker.record_success()
+            else:
+                self.breaker.release()
+            return None
+        self.breaker.record_failure()
+        self._count('failures')
+        if attempt >= self.retries:
+            return None
+        return self._backoff(attempt)
+
+    def call(self, fn: Callable[[float], Any], idempotent: bool = True) -> Any:
+        """
+        Run the blocking request `fn(timeout)` under the policy.
+
+        Parameters:
+        fn (Callable): The request, it must give up after the timeout it is passed.
+        idempotent (bool): Whether a duplicate request is harmless, required for hedging.
+
+        Returns:
+        Any: The result of the first successful attempt.
+        """
+        attempt = 0
+        while True:
+            timeout = self._before_attempt(attempt)
+            start = time.monotonic()
+            try:
+                hedge_delay = self._hedge_delay(idempotent, timeout)
+                result = fn(timeout) if hedge_delay is None else self._hedged(fn, timeout, hedge_delay)
+            except Exception as e:
+                delay = self._failed(e, attempt)
+                if delay is None:
+                    self._count('errors')
+                    raise
+                self._count('retries')
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.latency.record(time.monotonic() - start)
+            self.breaker.record_success()
+            self._count('successes')
+            return result
+
+    def _hedged(self, fn: Callable[[float], Any], timeout: float, hedge_delay: float) -> Any:
+        end = time.monotonic() + timeout
+        primary = submit_in_context(self.executor, fn, timeout)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        self._count('hedges')
+        hedged = submit_in_context(self.executor, fn, max(end - time.monotonic(), 0.001))
+        pending, error = {primary, hedged}, None
+        while pending:
+            done, pending = wait(pending, timeout=max(end - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                # Both attempts keep their workers until their own timeout, their results are discarded
+                raise FutureTimeoutError(f"{self.name} did not answer within {timeout}s")
+            for future in done:
+                if future.exception() is None:
+                    if future is hedged:
+                        self._count('hedge_wins')
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def acall(self, fn: Callable[[float], Awaitable[Any]], idempotent: bool = True) -> Any:
+        """Async variant of `call`, each attempt is also bounded with `asyncio.wait_for`."""
+        attempt = 0
+        while True:
+            timeout = self._before_attempt(attempt)
+            start = time.monotonic()
+            try:
+                hedge_delay = self._hedge_delay(idempotent, timeout)
+                if hedge_delay is None:
+                    result = await asyncio.wait_for(fn(timeout), timeout)
+                else:
+                    result = await self._ahedged(fn, timeout, hedge_delay)
+            except Exception as e:
+                delay = self._failed(e, attempt)
+                if delay is None:
+                    self._count('errors')
+                    raise
+                self._count('retries')
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.latency.record(time.monotonic() - start)
+            self.breaker.record_success()
+            self._count('successes')
+            return result
+
+    async def _ahedged(self, fn: Callable[[float], Awaitable[Any]], timeout: float, hedge_delay: float) -> Any:
+        end = time.monotonic() + timeout
+        primary = asyncio.ensure_future(fn(timeout))
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        self._count('hedges')
+        hedged = asyncio.ensure_future(fn(max(end - time.monotonic(), 0.001)))
+        pending, error = {primary, hedged}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(end - time.monotonic(), 0), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError(f"{self.name} did not answer within {timeout}s")
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedged:
+                            self._count('hedge_wins')
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The losing request is cancelled, unlike threads tasks can be
+            for task in pending:
+                task.cancel()
+
+    def metrics(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        p50 = self.latency.quantile(0.5)
+        p95 = self.latency.quantile(0.95)
+        stats['state'] = self.breaker.state
+        stats['circuit_opened'] = self.breaker.opened
+        stats['timeout'] = self.timeout
+        stats['p50_ms'] = p50 * 1000 if p50 is not None else None
+        stats['p95_ms'] = p95 * 1000 if p95 is not None else None
+        stats['error_rate'] = stats['errors'] / stats['calls'] if stats['calls'] else 0.0
+        return stats
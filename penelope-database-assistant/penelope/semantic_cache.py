@@ -0,0 +1,285 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+import threading
+import time
+import re
+import os
+
+SEMANTIC_CACHE_MODEL = os.getenv('SEMANTIC_CACHE_MODEL', "sentence-transformers/all-MiniLM-L6-v2")
+
+MARKET = 'market'
+DEFINITION = 'definition'
+GENERAL = 'general'
+
+# Seconds a cached answer is served, per intent: prices move, explanations do not
+DEFAULT_INTENT_TTLS = {
+    MARKET: 60,
+    DEFINITION: 24 * 3600,
+    GENERAL: 600,
+}
+
+MARKET_TERMS = re.compile(
+    r"\b(price|prices|priced|worth|cost|market\s*cap|mcap|volume|tvl|ath|atl|supply|fees?|revenue|"
+    r"today|now|current|currently|latest|news|24h|this\s+week|pump|dump|chart|trading)\b",
+    re.IGNORECASE,
+)
+DEFINITION_TERMS = re.compile(
+    r"^\s*(what\s+(is|are)|what's|whats|explain|define|definition\s+of|how\s+(does|do)|tell\s+me\s+about)\b",
+    re.IGNORECASE,
+)
+# Follow-ups that only make sense with the session's history are never shared across sessions
+CONTEXTUAL_TERMS = re.compile(r"\b(it|its|it's|those|these|they|them|their|above|previous|same)\b", re.IGNORECASE)
+NUMBERS = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+def classify_intent(question: str) -> str:
+    """Return MARKET, DEFINITION or GENERAL. Market questions win, "what is eth's price" is one."""
+    if MARKET_TERMS.search(question):
+        return MARKET
+    if DEFINITION_TERMS.search(question):
+        return DEFINITION
+    return GENERAL
+
+
+def question_text(input: Any) -> str:
+    """The text of a user input, either a plain string or the JSON body of /process."""
+    if isinstance(input, str):
+        return input
+    if isinstance(input, dict):
+        for key in ('input', 'question', 'message'):
+            if isinstance(input.get(key), str):
+                return input[key]
+    return str(input)
+
+
+class TextEmbedder:
+    """
+    Sentence embeddings on CPU: mean pooled and L2 normalized, so a dot product is a cosine similarity.
+
+    The model is loaded on first use. A failed load (e.g. no weights available offline) is not
+    retried, every later call raises right away.
+    """
+
+    def __init__(self, model_name: str = SEMANTIC_CACHE_MODEL, max_length: int = 128):
+        self.model_name = model_name
+        self.max_length = max_length
+        self.tokenizer = None
+        self.model = None
+        self.load_error = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.model is not None:
+                return
+            if self.load_error is not None:
+                raise RuntimeError(self.load_error)
+            try:
+                from transformers import AutoTokenizer, AutoModel
+
+                self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                model = AutoModel.from_pretrained(self.model_name)
+                model.eval()
+                self.model = model
+            except Exception as e:
+                self.load_error = f'Could not load {self.model_name}: {str(e)}'
+                raise RuntimeError(self.load_error)
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        import torch
+
+        self.load()
+        batch = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="pt")
+        with torch.inference_mode():
+            hidden = self.model(**batch).last_hidden_state
+            mask = batch['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+            embeddings = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            embeddings = torch.nn.functional.normalize(embeddings, dim=-1)
+        return embeddings.numpy().astype(np.float32)
+
+
+class SemanticCache:
+    """
+    Answer cache keyed by meaning instead of exact text.
+
+    Questions are embedded and compared by cosine similarity against a bounded in-memory
+    index (a preallocated matrix, searched with one matrix-vector product). A cached answer
+    is returned when a stored question is at least `threshold` similar, has the same intent,
+    mentions the same numbers (so "price in May 2014" never answers "price in May 2015") and has
+    the same `subject` (so "price of ETH" never answers "price of SOL"), and its intent TTL has
+    not expired. Without a `subject` function every question has the same subject. When the
+    index is full, an expired entry is replaced, otherwise the least recently used one.
+    """
+
+    def __init__(self, embed: Callable[[List[str]], np.ndarray] = None, maxsize: int = 2048, threshold: float = 0.92,
+                 intent_ttls: Optional[Dict[str, float]] = None, enabled: bool = True, name: str = 'semantic',
+                 subject: Optional[Callable[[str], frozenset]] = None):
+        self.embed = embed if embed is not None else TextEmbedder()
+        self.subject = subject
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.intent_ttls = {**DEFAULT_INTENT_TTLS, **(intent_ttls or {})}
+        self.enabled = enabled
+        self.name = name
+        self.lock = threading.Lock()
+
+        # Slot-indexed storage, the vectors matrix is allocated on the first store
+        self.vectors = None
+        self.entries: List[Optional[tuple]] = [None] * maxsize
+        self.active = np.zeros(maxsize, dtype=bool)
+        self.expires_at = np.zeros(maxsize)
+        self.last_used = np.zeros(maxsize)
+
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'bypassed': 0,
+            'stores': 0,
+            'expirations': 0,
+            'evictions': 0,
+            'embed_errors': 0,
+            'latency_saved_seconds': 0.0,
+            'lookup_seconds': 0.0,
+        }
+        self.intent_hits = {intent: 0 for intent in self.intent_ttls}
+
+    def warm_up(self):
+        """Load the embedding model ahead of the first lookup."""
+        if self.enabled:
+            try:
+                self.embed(["warm up"])
+            except Exception as e:
+                print(f'{self.name} cache disabled: {str(e)}')
+
+    def _key(self, question: str) -> tuple:
+        # Everything but the embedding that must match for a hit
+        subject = self.subject(question) if self.subject is not None else frozenset()
+        return classify_intent(question), frozenset(NUMBERS.findall(question)), subject
+
+    def _embed(self, question: str) -> Optional[np.ndarray]:
+        try:
+            return self.embed([question])[0]
+        except Exception:
+            with self.lock:
+                self.stats['embed_errors'] += 1
+            return None
+
+    def lookup(self, question: str) -> Tuple[Optional[Any], Optional[np.ndarray]]:
+        """
+        Look up a near-duplicate of `question`.
+
+        Returns:
+        tuple: The cached value (None on a miss) and the question's embedding, to pass to `store`
+        (None when the question is not cacheable).
+        """
+        if not self.enabled:
+            return None, None
+        if CONTEXTUAL_TERMS.search(question):
+            with self.lock:
+                self.stats['bypassed'] += 1
+            return None, None
+
+        start = time.perf_counter()
+        vector = self._embed(question)
+        if vector is None:
+            return None, None
+
+        key = self._key(question)
+        intent = key[0]
+        now = time.monotonic()
+
+        with self.lock:
+            value = None
+            if self.vectors is not None:
+                scores = self.vectors @ vector
+                scores[~self.active] = -np.inf
+                candidates = np.flatnonzero(scores >= self.threshold)
+                for slot in candidates[np.argsort(-scores[candidates])]:
+                    _, entry_key, entry_value, compute_seconds = self.entries[slot]
+                    if self.expires_at[slot] <= now:
+                        self._remove(slot)
+                        self.stats['expirations'] += 1
+                        continue
+                    if entry_key == key:
+                        value = entry_value
+                        self.last_used[slot] = now
+                        break
+
+            elapsed = time.perf_counter() - start
+            self.stats['lookup_seconds'] += elapsed
+            if value is None:
+                self.stats['misses'] += 1
+            else:
+                self.stats['hits'] += 1
+                self.stats['latency_saved_seconds'] += max(compute_seconds - elapsed, 0.0)
+                self.intent_hits[intent] += 1
+        return value, vector
+
+    def store(self, question: str, value: Any, compute_seconds: float, vector: Optional[np.ndarray] = None):
+        """
+        Cache the answer to `question`.
+
+        Parameters:
+        question (str): The user question.
+        value (Any): The answer to serve for near-duplicates.
+        compute_seconds (float): How long the answer took, counted as saved on every hit.
+        vector (np.ndarray): The embedding returned by `lookup`, computed again when omitted.
+        """
+        if not self.enabled or CONTEXTUAL_TERMS.search(question):
+            return
+        if vector is None:
+            vector = self._embed(question)
+            if vector is None:
+                return
+
+        key = self._key(question)
+        intent = key[0]
+        now = time.monotonic()
+        with self.lock:
+            if self.vectors is None:
+                self.vectors = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+
+            slot = self._free_slot(now)
+            self.vectors[slot] = vector
+            self.entries[slot] = (question, key, value, compute_seconds)
+            self.active[slot] = True
+            self.expires_at[slot] = now + self.intent_ttls[intent]
+            self.last_used[slot] = now
+            self.stats['stores'] += 1
+
+    def _free_slot(self, now: float) -> int:
+        # Called with the lock held: an empty slot, else an expired entry, else the least recently used
+        empty = np.flatnonzero(~self.active)
+        if len(empty):
+            return int(empty[0])
+
+        slot = int(np.argmin(self.expires_at))
+        if self.expires_at[slot] <= now:
+            self.stats['expirations'] += 1
+        else:
+            slot = int(np.argmin(self.last_used))
+            self.stats['evictions'] += 1
+        self._remove(slot)
+        return slot
+
+    def _remove(self, slot: int):
+        self.active[slot] = False
+        self.entries[slot] = None
+
+    def clear(self):
+        with self.lock:
+            self.active[:] = False
+            self.entries = [None] * self.maxsize
+
+    def metrics(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['size'] = int(self.active.sum())
+            stats['hits_by_intent'] = dict(self.intent_hits)
+        lookups = stats['hits'] + stats['misses']
+        stats['maxsize'] = self.maxsize
+        stats['threshold'] = self.threshold
+        stats['enabled'] = self.enabled
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['lookup_ms_avg'] = stats['lookup_seconds'] * 1000 / lookups if lookups else 0.0
+        return stats
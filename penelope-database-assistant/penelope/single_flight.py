@@ -0,0 +1,102 @@
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+import threading
+import asyncio
+
+
+def request_key(url: str, headers: Optional[Dict[str, str]] = None, params: Optional[Dict[str, Any]] = None) -> tuple:
+    """Identity of a GET request: the URL, the query parameters and the headers, in any order."""
+    return (
+        url,
+        tuple(sorted((params or {}).items())),
+        tuple(sorted((headers or {}).items())),
+    )
+
+
+class SingleFlight:
+    """
+    Collapse concurrent identical calls into one.
+
+    The first caller for a key runs the call, every caller arriving while it is in flight
+    waits for it and receives the same result (or exception). Nothing is kept once the
+    call returns, caching is left to the callers. Threads and asyncio tasks are tracked
+    separately, a blocking call never waits on the event loop or the other way around.
+    """
+
+    def __init__(self, name: str = 'single_flight'):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls: Dict[Hashable, Future] = {}
+        self.async_calls: Dict[Hashable, asyncio.Future] = {}
+        self.stats = {
+            'calls': 0,
+            'collapsed': 0,
+            'errors': 0,
+        }
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run `fn`, or wait for the identical call already in flight.
+
+        Parameters:
+        key (Hashable): Identity of the call, e.g. `request_key(...)`.
+        fn (Callable): The blocking call.
+
+        Returns:
+        Any: The result of the single call for `key`.
+        """
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.calls[key] = future
+                self.stats['calls'] += 1
+            else:
+                self.stats['collapsed'] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            with self.lock:
+                self.stats['errors'] += 1
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Async variant of `do`. The call runs in its own task, a cancelled waiter does not cancel it."""
+        key = (id(asyncio.get_running_loop()), key)
+        task = self.async_calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.async_calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            with self.lock:
+                self.stats['calls'] += 1
+        else:
+            with self.lock:
+                self.stats['collapsed'] += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        self.async_calls.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            with self.lock:
+                self.stats['errors'] += 1
+
+    def metrics(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = len(self.calls) + len(self.async_calls)
+        requested = stats['calls'] + stats['collapsed']
+        stats['collapse_rate'] = stats['collapsed'] / requested if requested else 0.0
+        return stats
@@ -0,0 +1,50 @@
+import subprocess
+import argparse
+import json
+import sys
+import os
+
+# Measured in a fresh interpreter: importing index, creating the app and serving a first request
+# without any DB or network initialization (the warm-up runs after the port is bound)
+CHILD = """
+import time, json
+start = time.perf_counter()
+import index
+imported = time.perf_counter()
+app = index.create_app(warm_up_mode='lazy')
+response = app.test_client().get('/')
+first_request = time.perf_counter()
+print(json.dumps({
+    'import_seconds': imported - start,
+    'first_request_seconds': first_request - start,
+    'status': response.status_code,
+}))
+"""
+
+STARTUP_BUDGET_SECONDS = float(os.getenv('STARTUP_BUDGET_SECONDS', 1.0))
+
+
+def measure_startup() -> dict:
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check Penelope's import time and time to first request against a budget")
+    parser.add_argument('--budget', type=float, default=STARTUP_BUDGET_SECONDS)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    runs = [measure_startup() for _ in range(args.runs)]
+    best = min(runs, key=lambda run: run['first_request_seconds'])
+    print(f"import: {best['import_seconds']:.3f}s, first request: {best['first_request_seconds']:.3f}s (budget {args.budget:.3f}s)")
+
+    if best['status'] != 200 or best['first_request_seconds'] > args.budget:
+        print("Startup budget exceeded")
+        sys.exit(1)
@@ -0,0 +1,248 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import deque
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+import threading
+import logging
+import bisect
+import json
+import time
+import uuid
+import re
+
+# Upper bounds of the latency histogram buckets (seconds), from a cache hit to a slow LLM call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUANTILES = (0.5, 0.95, 0.99)
+
+TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$")
+METRIC_NAME = re.compile(r"[^a-zA-Z0-9_]")
+
+# Trace ID of the request being served, carried into tool threads by `submit_in_context`
+trace_id: ContextVar[Optional[str]] = ContextVar('trace_id', default=None)
+
+logger = logging.getLogger('penelope.trace')
+
+
+def incoming_trace_id(headers: Mapping[str, str]) -> str:
+    """The trace ID of a W3C `traceparent` or an `X-Request-ID`/`X-Trace-ID` header, a new one otherwise."""
+    match = TRACEPARENT.match(headers.get('traceparent', '').strip().lower())
+    if match:
+        return match.group(1)
+    return headers.get('X-Trace-ID') or headers.get('X-Request-ID') or uuid.uuid4().hex
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + '}'
+
+
+class Histogram:
+    """Cumulative bucket counts for Prometheus, plus the latest `window` samples for exact recent quantiles."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, window: int = 1024):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            self.count += 1
+            self.samples.append(seconds)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+            samples = sorted(self.samples)
+        cumulative, running = [], 0
+        for bucket_count in counts:
+            running += bucket_count
+            cumulative.append(running)
+        quantiles = {
+            q: samples[min(int(q * len(samples)), len(samples) - 1)] if samples else None
+            for q in QUANTILES
+        }
+        return {'buckets': cumulative, 'sum': total, 'count': count, 'quantiles': quantiles}
+
+
+class Telemetry:
+    """
+    Per-stage timing spans and counters, exported in the Prometheus text format.
+
+    `span(stage)` times a block into the stage histogram and counts it as an error when it
+    raises. Component metrics (the `metrics()` dicts of the caches, limiters, ...) are
+    registered as collectors and exported as gauges when `/metrics` is scraped, so the hot
+    path only pays for the spans. With `trace_spans`, every span is also logged as a JSON line
+    carrying the request's trace ID.
+    """
+
+    def __init__(self, prefix: str = 'penelope', buckets: Tuple[float, ...] = DEFAULT_BUCKETS, enabled: bool = True,
+                 trace_spans: bool = False):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.enabled = enabled
+        self.trace_spans = trace_spans
+        self.lock = threading.Lock()
+        self.stages: Dict[str, Histogram] = {}
+        self.errors: Dict[str, int] = {}
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], int] = {}
+        self.collectors: List[Tuple[str, Callable[[], dict], Optional[str]]] = []
+
+    def _histogram(self, stage: str) -> Histogram:
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.stages.setdefault(stage, Histogram(self.buckets))
+        return histogram
+
+    @contextmanager
+    def span(self, stage: str):
+        """Time the enclosed block as `stage`."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, error)
+
+    def observe(self, stage: str, seconds: float, error: bool = False):
+        if not self.enabled:
+            return
+        self._histogram(stage).observe(seconds)
+        if error:
+            with self.lock:
+                self.errors[stage] = self.errors.get(stage, 0) + 1
+        if self.trace_spans:
+            logger.info(json.dumps({
+                'trace_id': trace_id.get(),
+                'stage': stage,
+                'duration_ms': round(seconds * 1000, 3),
+                'error': error,
+            }))
+
+    def increment(self, name: str, **labels):
+        """Add one to the counter `name` with `labels`, e.g. `increment('answers', outcome='cached')`."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def register(self, name: str, collect: Callable[[], dict], label: Optional[str] = None):
+        """
+        Export the numeric values of `collect()` as gauges named `<prefix>_<name>_<key>`.
+
+        Parameters:
+        name (str): The metric family, e.g. 'semantic_cache'.
+        collect (Callable): Returns a metrics dict, nested dicts are flattened into the names.
+        label (Optional[str]): When set, the top level keys of the dict become this label, e.g.
+        'upstream' for `{'coingecko': {...}, 'defillama': {...}}`.
+        """
+        self.collectors.append((name, collect, label))
+
+    def metrics(self) -> dict:
+        """Count, errors and recent p50/p95/p99 (milliseconds) of every stage."""
+        with self.lock:
+            stages = dict(self.stages)
+            errors = dict(self.errors)
+        result = {}
+        for stage, histogram in sorted(stages.items()):
+            snapshot = histogram.snapshot()
+            result[stage] = {
+                'count': snapshot['count'],
+                'errors': errors.get(stage, 0),
+                **{
+                    f'p{int(q * 100)}_ms': value * 1000 if value is not None else None
+                    for q, value in snapshot['quantiles'].items()
+                },
+            }
+        return result
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self.lock:
+            stages = dict(self.stages)
+            errors = dict(self.errors)
+            counters = dict(self.counters)
+
+        duration = f'{self.prefix}_stage_duration_seconds'
+        quantile = f'{self.prefix}_stage_duration_quantile_seconds'
+        lines += [f'# HELP {duration} Duration of the answer stages.', f'# TYPE {duration} histogram']
+        snapshots = {stage: histogram.snapshot() for stage, histogram in sorted(stages.items())}
+        for stage, snapshot in snapshots.items():
+            for bound, count in zip(list(self.buckets) + ['+Inf'], snapshot['buckets']):
+                lines.append(f'{duration}_bucket{format_labels({"stage": stage, "le": bound})} {count}')
+            lines.append(f'{duration}_sum{format_labels({"stage": stage})} {snapshot["sum"]}')
+            lines.append(f'{duration}_count{format_labels({"stage": stage})} {snapshot["count"]}')
+
+        lines += [f'# HELP {quantile} Quantiles of the latest stage durations.', f'# TYPE {quantile} gauge']
+        for stage, snapshot in snapshots.items():
+            for q, value in snapshot['quantiles'].items():
+                if value is not None:
+                    lines.append(f'{quantile}{format_labels({"stage": stage, "quantile": q})} {value}')
+
+        stage_errors = f'{self.prefix}_stage_errors_total'
+        lines += [f'# HELP {stage_errors} Stages that raised.', f'# TYPE {stage_errors} counter']
+        for stage, count in sorted(errors.items()):
+            lines.append(f'{stage_errors}{format_labels({"stage": stage})} {count}')
+
+        families: Dict[str, List[str]] = {}
+        for (name, labels), count in sorted(counters.items()):
+            families.setdefault(f'{self.prefix}_{name}_total', []).append(f'{format_labels(dict(labels))} {count}')
+        for family, samples in families.items():
+            lines.append(f'# TYPE {family} counter')
+            lines += [f'{family}{sample}' for sample in samples]
+
+        lines += self._render_collectors()
+        return '\n'.join(lines) + '\n'
+
+    def _render_collectors(self) -> List[str]:
+        families: Dict[str, List[str]] = {}
+        for name, collect, label in self.collectors:
+            try:
+                values = collect()
+            except Exception as e:
+                print(f'{name} metrics error: {str(e)}')
+                continue
+            groups = values.items() if label else [(None, values)]
+            for label_value, group in groups:
+                labels = {label: label_value} if label else {}
+                for key, value in self._flatten(group):
+                    family = METRIC_NAME.sub('_', f'{self.prefix}_{name}_{key}')
+                    families.setdefault(family, []).append(f'{family}{format_labels(labels)} {value}')
+
+        lines = []
+        for family, samples in families.items():
+            lines.append(f'# TYPE {family} gauge')
+            lines += samples
+        return lines
+
+    @classmethod
+    def _flatten(cls, values: dict, prefix: str = ''):
+        # Numeric leaves only, booleans as 0/1
+        for key, value in values.items():
+            name = f'{prefix}{key}'
+            if isinstance(value, dict):
+                yield from cls._flatten(value, f'{name}_')
+            elif isinstance(value, bool):
+                yield name, int(value)
+            elif isinstance(value, (int, float)):
+                yield name, value
@@ -0,0 +1,247 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+import threading
+import asyncio
+import time
+
+FRESH = 'fresh'
+STALE = 'stale'
+REFRESH = 'refresh'
+MISS = 'miss'
+
+# True while a loader runs as a background refresh, so loaders can tell refreshes from misses
+background_refresh: ContextVar[bool] = ContextVar('background_refresh', default=False)
+
+
+class TTLCache:
+    """
+    Bounded LRU cache with a per-entry TTL and stale-while-revalidate.
+
+    An entry is fresh for `ttl` seconds, then served stale for another `stale_ttl` seconds
+    while a single background refresh reloads it. Loaders return None on failure, in which
+    case nothing is cached and a stale entry is kept.
+    """
+
+    def __init__(self, maxsize: int = 1024, name: str = 'cache', refresh_workers: int = 4):
+        self.maxsize = maxsize
+        self.name = name
+        self.refresh_workers = refresh_workers
+        self.entries = OrderedDict()
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.executor = None
+        self.background_tasks = set()
+        self.stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+            'evictions': 0,
+        }
+
+    def lookup(self, key: Hashable):
+        """
+        Look up a key and claim its background refresh when it is stale.
+
+        Returns:
+        tuple: The cached value (None on a miss) and one of FRESH, STALE, REFRESH or MISS.
+        REFRESH means the entry is stale and the caller is responsible for refreshing it.
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires_at, stale_until = entry
+                if now < expires_at:
+                    self.entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return value, FRESH
+                if now < stale_until:
+                    self.entries.move_to_end(key)
+                    self.stats['stale_hits'] += 1
+                    if key in self.refreshing:
+                        return value, STALE
+                    self.refreshing.add(key)
+                    return value, REFRESH
+                del self.entries[key]
+            self.stats['misses'] += 1
+            return None, MISS
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        value, _ = self.lookup(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float, stale_ttl: float = 0):
+        now = time.monotonic()
+        with self.lock:
+            self.entries[key] = (value, now + ttl, now + ttl + stale_ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any], ttl: float, stale_ttl: float = 0):
+        """
+        Return the cached value for `key`, calling `loader` on a miss.
+
+        Parameters:
+        key (Hashable): The cache key.
+        loader (Callable): Blocking function returning the value, or None on failure.
+        ttl (float): Seconds the loaded value stays fresh.
+        stale_ttl (float): Seconds the value may be served stale while it is refreshed.
+
+        Returns:
+        Any: The cached or freshly loaded value, None if the load failed.
+        """
+        value, state = self.lookup(key)
+        if state == MISS:
+            value = loader()
+            if value is not None:
+                self.set(key, value, ttl, stale_ttl)
+            return value
+
+        if state == REFRESH:
+            self._get_executor().submit(self._refresh, key, loader, ttl, stale_ttl)
+        return value
+
+    async def aget_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], ttl: float, stale_ttl: float = 0):
+        """Async variant of `get_or_load`, refreshing stale entries in a background task."""
+        value, state = self.lookup(key)
+        if state == MISS:
+            value = await loader()
+            if value is not None:
+                self.set(key, value, ttl, stale_ttl)
+            return value
+
+        if state == REFRESH:
+            task = asyncio.create_task(self._arefresh(key, loader, ttl, stale_ttl))
+            self.background_tasks.add(task)
+            task.add_done_callback(self.background_tasks.discard)
+        return value
+
+    def _lookup_many(self, keys: List[Hashable]):
+        values, missing, stale = {}, [], []
+        for key in keys:
+            value, state = self.lookup(key)
+            if state == MISS:
+                missing.append(key)
+                continue
+            values[key] = value
+            if state == REFRESH:
+                stale.append(key)
+        return values, missing, stale
+
+    def _store_many(self, values: Dict[Hashable, Any], keys: List[Hashable], loaded: Optional[Dict[Hashable, Any]], ttl, stale_ttl):
+        for key in keys:
+            value = (loaded or {}).get(key)
+            if value is not None:
+                self.set(key, value, ttl, stale_ttl)
+                values[key] = value
+
+    def get_many_or_load(self, keys: List[Hashable], loader: Callable[[List[Hashable]], Dict[Hashable, Any]], ttl: float, stale_ttl: float = 0) -> Dict[Hashable, Any]:
+        """
+        Batched `get_or_load`: the missing keys are loaded with a single `loader` call, and the
+        stale ones are refreshed together by another call in the background.
+
+        Parameters:
+        keys (List[Hashable]): The cache keys.
+        loader (Callable): Blocking function taking a list of keys and returning a dict of the
+        values it could load, keys left out are treated as failed loads.
+        ttl (float): Seconds the loaded values stay fresh.
+        stale_ttl (float): Seconds the values may be served stale while they are refreshed.
+
+        Returns:
+        Dict[Hashable, Any]: The cached or freshly loaded value of each key that has one.
+        """
+        values, missing, stale = self._lookup_many(keys)
+        if missing:
+            self._store_many(values, missing, loader(missing), ttl, stale_ttl)
+        if stale:
+            self._get_executor().submit(self._refresh_many, stale, loader, ttl, stale_ttl)
+        return values
+
+    async def aget_many_or_load(self, keys: List[Hashable], loader: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]], ttl: float, stale_ttl: float = 0) -> Dict[Hashable, Any]:
+        """Async variant of `get_many_or_load`, refreshing stale entries in a background task."""
+        values, missing, stale = self._lookup_many(keys)
+        if missing:
+            self._store_many(values, missing, await loader(missing), ttl, stale_ttl)
+        if stale:
+            task = asyncio.create_task(self._arefresh_many(stale, loader, ttl, stale_ttl))
+            self.background_tasks.add(task)
+            task.add_done_callback(self.background_tasks.discard)
+        return values
+
+    def _refresh_many(self, keys, loader, ttl, stale_ttl):
+        token = background_refresh.set(True)
+        try:
+            loaded = loader(keys) or {}
+        except Exception as e:
+            print(f'{self.name} refresh error: {str(e)}')
+            loaded = {}
+        finally:
+            background_refresh.reset(token)
+        for key in keys:
+            self._store_refresh(key, loaded.get(key), ttl, stale_ttl)
+
+    async def _arefresh_many(self, keys, loader, ttl, stale_ttl):
+        # Refresh tasks run in a copy of the caller's context, the flag stays in the task
+        background_refresh.set(True)
+        try:
+            loaded = await loader(keys) or {}
+        except Exception as e:
+            print(f'{self.name} refresh error: {str(e)}')
+            loaded = {}
+        for key in keys:
+            self._store_refresh(key, loaded.get(key), ttl, stale_ttl)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.refresh_workers,
+                    thread_name_prefix=f'{self.name}-refresh'
+                )
+            return self.executor
+
+    def _refresh(self, key, loader, ttl, stale_ttl):
+        token = background_refresh.set(True)
+        try:
+            self._store_refresh(key, loader(), ttl, stale_ttl)
+        except Exception as e:
+            print(f'{self.name} refresh error: {str(e)}')
+            self._store_refresh(key, None, ttl, stale_ttl)
+        finally:
+            background_refresh.reset(token)
+
+    async def _arefresh(self, key, loader, ttl, stale_ttl):
+        background_refresh.set(True)
+        try:
+            self._store_refresh(key, await loader(), ttl, stale_ttl)
+        except Exception as e:
+            print(f'{self.name} refresh error: {str(e)}')
+            self._store_refresh(key, None, ttl, stale_ttl)
+
+    def _store_refresh(self, key, value, ttl, stale_ttl):
+        if value is not None:
+            self.set(key, value, ttl, stale_ttl)
+        with self.lock:
+            self.refreshing.discard(key)
+            self.stats['refreshes'] += 1
+            if value is None:
+                self.stats['refresh_errors'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def metrics(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self.entries)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['maxsize'] = self.maxsize
+        stats['hit_rate'] = (stats['hits'] + stats['stale_hits']) / lookups if lookups else 0.0
+        return stats
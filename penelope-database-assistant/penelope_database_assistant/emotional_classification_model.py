@@ -1,14 +1,129 @@
+from typing import Dict, List
+import threading
+import argparse
+import random
+import time
+import os
 import torch
 from transformers import DistilBertTokenizer, DistilBertForSequenceClassification
 
-tokenizer = DistilBertTokenizer.from_pretrained("distilbert-base-uncased-finetuned-sst-2-english")
-model = DistilBertForSequenceClassification.from_pretrained("distilbert-base-uncased-finetuned-sst-2-english")
+SST2_MODEL = "distilbert-base-uncased-finetuned-sst-2-english"
 
-inputs = tokenizer("Hello, my dog is gorgeous", return_tensors="pt")
+SENTIMENT_MAX_BATCH_SIZE = int(os.getenv('SENTIMENT_MAX_BATCH_SIZE', 32))
+SENTIMENT_MAX_LENGTH = int(os.getenv('SENTIMENT_MAX_LENGTH', 512))
 
-with torch.no_grad():
-    logits = model(**inputs).logits
-predicted_class_id = logits.argmax().item()
 
-print("Predicted class",predicted_class_id)
-print("Model:",model.config.id2label[predicted_class_id])
\ No newline at end of file
+class SentimentClassifier:
+    """
+    Batched DistilBERT SST-2 sentiment classifier.
+
+    Inputs are tokenized once, sorted by token length and split into batches of at most
+    `max_batch_size` texts, so each batch is padded to the length of its own longest text
+    instead of the longest text of the whole request.
+    """
+
+    def __init__(self, model_name: str = SST2_MODEL, max_batch_size: int = SENTIMENT_MAX_BATCH_SIZE, max_length: int = SENTIMENT_MAX_LENGTH):
+        self.tokenizer = DistilBertTokenizer.from_pretrained(model_name)
+        self.model = DistilBertForSequenceClassification.from_pretrained(model_name)
+        self.model.eval()
+        self.max_batch_size = max_batch_size
+        self.max_length = max_length
+
+    def classify(self, texts: List[str]) -> List[Dict]:
+        """
+        Classify the sentiment of a list of texts.
+
+        Parameters:
+        texts (List[str]): The texts to classify, e.g. user messages or news articles.
+
+        Returns:
+        List[Dict]: The label ('POSITIVE' or 'NEGATIVE') and score of each text, in input order.
+        """
+        if not texts:
+            return []
+
+        encodings = self.tokenizer(texts, truncation=True, max_length=self.max_length)
+        order = sorted(range(len(texts)), key=lambda index: len(encodings['input_ids'][index]))
+        results = [None] * len(texts)
+
+        with torch.inference_mode():
+            for start in range(0, len(order), self.max_batch_size):
+                batch_indices = order[start:start + self.max_batch_size]
+                batch = self.tokenizer.pad(
+                    {
+                        'input_ids': [encodings['input_ids'][index] for index in batch_indices],
+                        'attention_mask': [encodings['attention_mask'][index] for index in batch_indices],
+                    },
+                    return_tensors="pt",
+                )
+                probabilities = self.model(**batch).logits.softmax(dim=-1)
+                scores, predicted_class_ids = probabilities.max(dim=-1)
+
+                for index, score, predicted_class_id in zip(batch_indices, scores.tolist(), predicted_class_ids.tolist()):
+                    results[index] = {'label': self.model.config.id2label[predicted_class_id], 'score': score}
+
+        return results
+
+
+sentiment_classifier = None
+sentiment_classifier_lock = threading.Lock()
+
+
+def get_sentiment_classifier() -> SentimentClassifier:
+    """Return the process-wide classifier, loading the model on first use."""
+    global sentiment_classifier
+    if sentiment_classifier is None:
+        with sentiment_classifier_lock:
+            if sentiment_classifier is None:
+                sentiment_classifier = SentimentClassifier()
+    return sentiment_classifier
+
+
+def benchmark_throughput(classifier: SentimentClassifier, texts: List[str], batch_sizes: List[int]) -> Dict[str, float]:
+    """
+    Measure the CPU throughput (texts per second) of the classifier.
+
+    Parameters:
+    classifier (SentimentClassifier): The classifier to measure.
+    texts (List[str]): The texts to classify.
+    batch_sizes (List[int]): The max batch sizes to compare, 1 being one text per forward pass.
+
+    Returns:
+    Dict[str, float]: Texts per second for each batch size.
+    """
+    classifier.classify(texts[:classifier.max_batch_size])  # warm-up
+
+    throughput = {}
+    for batch_size in batch_sizes:
+        classifier.max_batch_size = batch_size
+        start = time.perf_counter()
+        classifier.classify(texts)
+        throughput[f'batch_size_{batch_size}'] = len(texts) / (time.perf_counter() - start)
+    return throughput
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sentiment classifier CPU throughput benchmark")
+    parser.add_argument('--texts', type=int, default=256)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    # Mix short user messages with longer article-like texts
+    random.seed(0)
+    sentences = [
+        "Hello, my dog is gorgeous",
+        "Bitcoin breaks a new all-time high as ETF inflows accelerate.",
+        "The exchange halted withdrawals after a security incident drained its hot wallet.",
+        "What was bitcoin's price in May 2014?",
+        "Regulators approved the proposal, and analysts expect liquidity to improve across the market.",
+    ]
+    texts = [" ".join(random.choices(sentences, k=random.randint(1, 12))) for _ in range(args.texts)]
+
+    classifier = SentimentClassifier()
+    print("Predictions:", classifier.classify(["Hello, my dog is gorgeous"]))
+    for name, value in benchmark_throughput(classifier, texts, args.batch_sizes).items():
+        print(f"{name}: {value:.1f} texts/s")
@@ -1,38 +1,169 @@
-import pandas as pd
+from concurrent.futures import Future
+from typing import List, Optional
+import threading
+import queue
+import time
+import os
+import torch
 from transformers import AutoTokenizer, AutoModelForTokenClassification
 from transformers import pipeline
 import yake
 
-# Load the tokenizer and model for NER
-tokenizer = AutoTokenizer.from_pretrained("dbmdz/bert-large-cased-finetuned-conll03-english")
-model = AutoModelForTokenClassification.from_pretrained("dbmdz/bert-large-cased-finetuned-conll03-english")
+NER_MODEL = "dbmdz/bert-large-cased-finetuned-conll03-english"
+
+# Batching and CPU threading configuration
+KEYWORDS_MAX_BATCH_SIZE = int(os.getenv('KEYWORDS_MAX_BATCH_SIZE', 16))
+KEYWORDS_MAX_WAIT_MS = float(os.getenv('KEYWORDS_MAX_WAIT_MS', 10))
+TORCH_NUM_THREADS = int(os.getenv('TORCH_NUM_THREADS', os.cpu_count() or 1))
+TORCH_NUM_INTEROP_THREADS = int(os.getenv('TORCH_NUM_INTEROP_THREADS', 1))
+
+
+def configure_torch_threads(num_threads: int = TORCH_NUM_THREADS, num_interop_threads: int = TORCH_NUM_INTEROP_THREADS):
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(num_interop_threads)
+    except RuntimeError:
+        # The inter-op pool can only be sized before the first parallel op ran
+        pass
+
+
+class KeywordExtractor:
+    """
+    Long-lived NER + YAKE keyword extraction.
+
+    The NER model and the YAKE extractor are loaded once. `combined_keywords_batch` runs the
+    NER pipeline over a list of texts in one batch, and `combined_keywords` queues a single
+    text so that concurrent callers are grouped into micro-batches of up to `max_batch_size`
+    texts, waiting at most `max_wait_ms` for a batch to fill.
+    """
+
+    def __init__(self, model_name: str = NER_MODEL, max_batch_size: int = KEYWORDS_MAX_BATCH_SIZE, max_wait_ms: float = KEYWORDS_MAX_WAIT_MS):
+        configure_torch_threads()
+
+        # Load the tokenizer and model for NER
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForTokenClassification.from_pretrained(model_name)
+        self.model.eval()
+
+        # Initialize the NER pipeline
+        self.nlp = pipeline("ner", model=self.model, tokenizer=self.tokenizer)
+        self.kw_extractor = yake.KeywordExtractor()
+
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.worker = None
+        self.worker_lock = threading.Lock()
+
+    def extract_ner_keywords_batch(self, texts: List[str]) -> List[List[str]]:
+        with torch.inference_mode():
+            ner_results = self.nlp(texts, batch_size=self.max_batch_size)
+        return [[result['word'] for result in text_results] for text_results in ner_results]
+
+    def yake_keywords(self, text: str) -> List[str]:
+        keywords = self.kw_extractor.extract_keywords(text)
+        return [kw for kw, _ in keywords]
+
+    def combined_keywords_batch(self, texts: List[str]) -> List[List[str]]:
+        """
+        Extract the combined NER and YAKE keywords of several texts.
+
+        Parameters:
+        texts (List[str]): The texts to process.
+
+        Returns:
+        List[List[str]]: The deduplicated keywords of each text, in input order.
+        """
+        if not texts:
+            return []
+
+        ner_keywords = self.extract_ner_keywords_batch(texts)
+        # Combine and deduplicate keywords
+        return [list(set(ner_kw + self.yake_keywords(text))) for text, ner_kw in zip(texts, ner_keywords)]
+
+    def combined_keywords(self, text: str, timeout: Optional[float] = None) -> List[str]:
+        """
+        Extract the combined keywords of one text through the micro-batching queue.
+
+        Parameters:
+        text (str): The text to process.
+        timeout (Optional[float]): Seconds to wait for the result.
+
+        Returns:
+        List[str]: The deduplicated keywords.
+        """
+        self.start()
+        future = Future()
+        self.requests.put((text, future))
+        return future.result(timeout=timeout)
+
+    def start(self):
+        if self.worker is not None:
+            return
+        with self.worker_lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, name='keyword-extraction', daemon=True)
+                self.worker.start()
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self.combined_keywords_batch([text for text, _ in batch])
+                for (_, future), keywords in zip(batch, results):
+                    future.set_result(keywords)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+keyword_extractor = None
+keyword_extractor_lock = threading.Lock()
+
+
+def get_keyword_extractor() -> KeywordExtractor:
+    """Return the process-wide extractor, loading the model on first use."""
+    global keyword_extractor
+    if keyword_extractor is None:
+        with keyword_extractor_lock:
+            if keyword_extractor is None:
+                keyword_extractor = KeywordExtractor()
+    return keyword_extractor
 
-# Initialize the NER pipeline
-nlp = pipeline("ner", model=model, tokenizer=tokenizer)
 
 # Function to extract NER keywords
 def extract_ner_keywords(text):
-    ner_results = nlp(text)
-    keywords = [result['word'] for result in ner_results]
-    return keywords
+    return get_keyword_extractor().extract_ner_keywords_batch([text])[0]
 
 # YAKE keyword extraction
 def yake_keywords(text):
-    kw_extractor = yake.KeywordExtractor()
-    keywords = kw_extractor.extract_keywords(text)
-    return [kw for kw, _ in keywords]
+    return get_keyword_extractor().yake_keywords(text)
 
 # Combining NER and YAKE
 def combined_keywords(text):
-    ner_keywords = extract_ner_keywords(text)
-    yake_kw = yake_keywords(text)
-    # Combine and deduplicate keywords
-    combined_kw = list(set(ner_keywords + yake_kw))
-    return combined_kw
-
-# Example user input
-user_input = "What was bitcoin's price in May 2014?"
-
-# Extract combined keywords
-keywords = combined_keywords(user_input)
-print("Combined Extracted Keywords:", keywords)
+    return get_keyword_extractor().combined_keywords(text)
+
+def combined_keywords_batch(texts):
+    return get_keyword_extractor().combined_keywords_batch(texts)
+
+
+if __name__ == "__main__":
+    # Example user input
+    user_input = "What was bitcoin's price in May 2014?"
+
+    # Extract combined keywords
+    keywords = combined_keywords(user_input)
+    print("Combined Extracted Keywords:", keywords)
@@ -3,17 +3,61 @@ from dotenv import load_dotenv
 import requests
 import os
 
+# Shares the TTL cache and the CoinGecko quota with the Penelope API, run it from the project root
+# as a module: `python -m services.coingecko.coingecko`
+from penelope.ttl_cache import TTLCache
+from penelope.rate_limiter import INTERACTIVE, RateLimiter, TokenBucketStore
+
 # Load environment variables from the .env file
 load_dotenv()
 COINGECKO_API_KEY = os.getenv("COINGECKO_API_KEY")
 
 BASE_URL = 'https://pro-api.coingecko.com/api/v3'
 
+# Seconds per request, a hung call would otherwise hold the cache's refresh of its key forever
+REQUEST_TIMEOUT = float(os.getenv('COINGECKO_TIMEOUT', 10))
+
 headers = {
             "Content-Type": "application/json",
             "x-cg-pro-api-key": COINGECKO_API_KEY,
         }
 
+# One TTL per field group (seconds): static metadata, market data and the daily historical price
+METADATA_TTL = float(os.getenv('TOKEN_METADATA_TTL', 24 * 3600))
+METADATA_STALE_TTL = float(os.getenv('TOKEN_METADATA_STALE_TTL', 7 * 24 * 3600))
+MARKET_TTL = float(os.getenv('TOKEN_MARKET_TTL', 60))
+MARKET_STALE_TTL = float(os.getenv('TOKEN_MARKET_STALE_TTL', 300))
+HISTORICAL_TTL = float(os.getenv('TOKEN_HISTORICAL_TTL', 24 * 3600))
+
+cache = TTLCache(maxsize=int(os.getenv('TOKEN_CACHE_SIZE', 1024)), name='coingecko')
+
+# Same bucket as the API workers (see RATE_LIMIT_* in penelope/index.py)
+rate_limiter = RateLimiter(
+    'coingecko',
+    TokenBucketStore(os.getenv('RATE_LIMIT_PATH', os.path.expanduser('~/.cache/penelope/rate_limits.sqlite3'))),
+    per_minute=float(os.getenv('COINGECKO_RATE_LIMIT', 500)),
+    burst=float(os.getenv('COINGECKO_BURST', 50)),
+    reserve=float(os.getenv('RATE_LIMIT_RESERVE', 0.2)),
+    enabled=os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+)
+
+
+def market_data_from_row(row):
+    # A `/coins/markets` row in the shape of the `market_data` of `/coins/{id}`, USD only
+    usd = lambda field: {'usd': row.get(field)}
+    return {
+        'market_cap': usd('market_cap'),
+        'total_volume': usd('total_volume'),
+        'current_price': usd('current_price'),
+        'ath': usd('ath'),
+        'ath_change_percentage': usd('ath_change_percentage'),
+        'fully_diluted_valuation': usd('fully_diluted_valuation'),
+        'total_supply': row.get('total_supply'),
+        'circulating_supply': row.get('circulating_supply'),
+        'max_supply': row.get('max_supply'),
+        'price_change_percentage_1y': row.get('price_change_percentage_1y_in_currency'),
+    }
+
 
 # Get basic data from Coingecko
 def get_token_data(coin):
@@ -26,12 +70,37 @@ def get_token_data(coin):
         formatted_date = one_year_ago.strftime('%d-%m-%Y')
 
         formatted_coin = str(coin).casefold().strip()
-        response = requests.get(f'{BASE_URL}/coins/{formatted_coin}', headers=headers)
-        historical_response = requests.get(f'{BASE_URL}/coins/{formatted_coin}/history?date={formatted_date}', headers=headers)
-      
-        if response.status_code == 200 and historical_response.status_code == 200:
-            response = response.json()
-            historical_response = historical_response.json()
+        errors = []
+
+        def fetch(url):
+            # A user is waiting on this call, it may use the quota kept from background refreshes
+            rate_limiter.acquire(level=INTERACTIVE, timeout=REQUEST_TIMEOUT)
+            response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+            if response.status_code != 200:
+                errors.append(response.content.decode('utf-8'))
+                return None
+            return response.json()
+
+        def fetch_coin():
+            # `/coins/{id}` carries both field groups, seed the market group while loading the metadata
+            payload = fetch(f'{BASE_URL}/coins/{formatted_coin}')
+            if payload is None:
+                return None
+            market_data = payload.pop('market_data', {})
+            cache.set(('market', formatted_coin), market_data, MARKET_TTL, MARKET_STALE_TTL)
+            return payload
+
+        def fetch_market():
+            # Only the market group expired, a `/coins/markets` row is much smaller than `/coins/{id}`
+            rows = fetch(f'{BASE_URL}/coins/markets?vs_currency=usd&ids={formatted_coin}&price_change_percentage=1y')
+            return market_data_from_row(rows[0]) if rows else None
+
+        metadata = cache.get_or_load(('metadata', formatted_coin), fetch_coin, METADATA_TTL, METADATA_STALE_TTL)
+        market_data = cache.get_or_load(('market', formatted_coin), fetch_market, MARKET_TTL, MARKET_STALE_TTL) if metadata else None
+        historical_response = cache.get_or_load(('historical', formatted_coin, formatted_date), lambda: fetch(f'{BASE_URL}/coins/{formatted_coin}/history?date={formatted_date}'), HISTORICAL_TTL)
+
+        if metadata and market_data is not None and historical_response:
+            response = {**metadata, 'market_data': market_data}
 
             id = response.get('id')
             symbol = response.get('symbol')
@@ -123,7 +192,7 @@ def get_token_data(coin):
                 'success': True
             }
         else:
-            return {'response': response.content.decode('utf-8'), 'success': False}
+            return {'response': errors[0] if errors else None, 'success': False}
     except Exception as e:
         return {'response': str(e), 'success': False}
     
@@ -0,0 +1,61 @@
+import json
+import uuid
+
+import pytest
+
+from batch import group_batch, ndjson_line, parse_batch
+
+SESSION = str(uuid.uuid4())
+
+
+def test_a_plain_list_is_a_batch_with_the_default_concurrency():
+    items = [{'input': 'price of ETH'}]
+    assert parse_batch(items, {}, max_items=10, max_concurrency=4) == (items, 4, False)
+
+
+def test_options_set_the_concurrency_within_bounds_and_the_stream():
+    items = [{'input': 'price of ETH'}]
+    assert parse_batch({'items': items, 'concurrency': 2, 'stream': True}, {}, 10, 4) == (items, 2, True)
+    assert parse_batch({'items': items, 'concurrency': 50}, {}, 10, 4)[1] == 4
+    assert parse_batch({'items': items, 'concurrency': -1}, {}, 10, 4)[1] == 1
+    assert parse_batch(items, {'Accept': 'application/x-ndjson'}, 10, 4)[2] is True
+
+
+@pytest.mark.parametrize('body', [None, [], {'items': []}, {'items': 'price of ETH'}, 'price of ETH'])
+def test_a_body_without_items_is_rejected(body):
+    with pytest.raises(ValueError):
+        parse_batch(body, {}, 10, 4)
+
+
+def test_a_batch_over_the_limit_is_rejected():
+    with pytest.raises(ValueError, match='At most 2 items'):
+        parse_batch([{'input': 'a'}] * 3, {}, max_items=2, max_concurrency=4)
+
+
+def test_invalid_items_get_an_error_and_duplicate_questions_are_grouped():
+    items = [
+        {'session_id': SESSION, 'input': 'price of ETH'},
+        {'input': ''},
+        {'session_id': 'not-a-uuid', 'input': 'price of SOL'},
+        {'input': 'news about bitcoin'},
+        {'session_id': str(uuid.uuid4()), 'input': 'price of ETH'},
+        'price of ETH',
+    ]
+
+    invalid, groups = group_batch(items)
+
+    assert [index for index, _ in invalid] == [1, 2, 5]
+    assert invalid[0][1] == {'success': False, 'error': 'ValueError: No input provided', 'response': None}
+    assert 'not a UUID' in invalid[1][1]['error']
+    assert groups == [[0, 4], [3]]
+
+
+def test_json_bodies_are_grouped_by_their_question():
+    items = [{'input': {'question': 'price of ETH'}}, {'input': 'price of ETH'}]
+    assert group_batch(items)[1] == [[0, 1]]
+
+
+def test_ndjson_line_carries_the_index():
+    line = ndjson_line(3, {'success': True, 'error': None, 'response': 'ok'})
+    assert line.endswith('\n') and line.count('\n') == 1
+    assert json.loads(line) == {'index': 3, 'success': True, 'error': None, 'response': 'ok'}
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+from completion_cache import CompletionCache, completion_key
+
+
+def counting(value):
+    calls = []
+
+    def call():
+        calls.append(1)
+        return value
+    return call, calls
+
+
+def test_key_depends_on_model_deployment_and_prompt():
+    key = completion_key('abacus', 'd1', 'prompt')
+    assert key == completion_key('abacus', 'd1', 'prompt')
+    assert len({key, completion_key('perplexity', 'd1', 'prompt'), completion_key('abacus', 'd2', 'prompt'),
+                completion_key('abacus', 'd1', 'prompt!')}) == 4
+
+
+def test_repeated_prompt_is_served_from_memory(tmp_path):
+    cache = CompletionCache(str(tmp_path / 'completions.sqlite3'))
+    call, calls = counting('answer')
+
+    assert cache.get_or_call('key', call, ttl=60) == 'answer'
+    assert cache.get_or_call('key', call, ttl=60) == 'answer'
+    assert calls == [1]
+    assert cache.metrics()['memory_hits'] == 1
+
+
+def test_disk_tier_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'completions.sqlite3')
+    CompletionCache(path).get_or_call('key', lambda: 'answer', ttl=60)
+
+    other = CompletionCache(path)
+    call, calls = counting('fresh')
+    assert other.get_or_call('key', call, ttl=60) == 'answer'
+    assert calls == []
+    assert other.metrics()['disk_hits'] == 1
+    # Promoted to memory for the rest of its TTL
+    assert other.get_or_call('key', call, ttl=60) == 'answer'
+    assert other.metrics()['memory_hits'] == 1
+
+
+def test_expired_completions_are_recomputed(tmp_path):
+    cache = CompletionCache(str(tmp_path / 'completions.sqlite3'))
+    cache.get_or_call('key', lambda: 'old', ttl=0.05)
+    time.sleep(0.1)
+
+    assert cache.get_or_call('key', lambda: 'new', ttl=60) == 'new'
+
+
+def test_bypass_failures_and_uncacheable_answers_are_not_stored(tmp_path):
+    cache = CompletionCache(str(tmp_path / 'completions.sqlite3'))
+
+    assert cache.get_or_call('bypass', lambda: 'answer', use_cache=False) == 'answer'
+    assert cache.get_or_call('failed', lambda: None) is None
+    assert cache.get_or_call('error', lambda: 'Error: upstream', cacheable=lambda value: not value.startswith('Error')) == 'Error: upstream'
+
+    assert cache.get('bypass') is None and cache.get('failed') is None and cache.get('error') is None
+    assert cache.metrics()['bypassed'] == 1
+    assert cache.metrics()['stores'] == 0
+
+
+def test_disk_tier_is_pruned_to_the_newest_entries(tmp_path):
+    path = str(tmp_path / 'completions.sqlite3')
+    cache = CompletionCache(path, max_disk_entries=2, prune_interval=3)
+    for index in range(3):
+        cache.set(f'key{index}', f'value{index}', ttl=60)
+        time.sleep(0.01)
+
+    other = CompletionCache(path)
+    assert other.get('key0') is None
+    assert other.get('key1') == 'value1' and other.get('key2') == 'value2'
+    assert cache.metrics()['disk_evictions'] == 1
+
+
+def test_disk_errors_fall_back_to_the_model(tmp_path):
+    # The database path is a directory, every disk read and write fails
+    cache = CompletionCache(str(tmp_path))
+    call, calls = counting('answer')
+
+    assert cache.get_or_call('key', call, ttl=60) == 'answer'
+    assert calls == [1]
+    assert cache.metrics()['disk_errors'] >= 1
+
+
+def test_async_lookup_shares_the_tiers(tmp_path):
+    path = str(tmp_path / 'completions.sqlite3')
+    CompletionCache(path).set('key', 'answer', ttl=60)
+    cache = CompletionCache(path)
+
+    async def call():
+        raise AssertionError('called the model on a hit')
+
+    async def run():
+        return [await cache.aget_or_call('key', call), await cache.aget_or_call('key', call)]
+
+    assert asyncio.run(run()) == ['answer', 'answer']
+    assert cache.metrics()['disk_hits'] == 1
+    assert cache.metrics()['memory_hits'] == 1
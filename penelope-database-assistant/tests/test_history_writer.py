@@ -0,0 +1,194 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional
+import threading
+import logging
+import json
+import time
+
+import pytest
+
+import history_writer
+from history_writer import HistoryQueueFull, HistoryWriter
+
+
+@dataclass
+class Message:
+    type: str
+    content: str
+    id: Optional[str] = None
+
+
+def serialize(message):
+    return {'type': message.type, 'data': {'content': message.content, 'id': message.id}}
+
+
+@pytest.fixture(autouse=True)
+def plain_insert_query(monkeypatch):
+    # The cursors below only read the parameters, psycopg is not needed to compose the statement
+    monkeypatch.setattr(history_writer, 'insert_query', lambda table_name, rows: (table_name, rows))
+
+
+class FakeCursor:
+    def __init__(self, pool):
+        self.pool = pool
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params):
+        if isinstance(params, dict):
+            messages = [message for session_id, message in self.pool.rows if session_id == params['session_id']]
+            limit = params['limit']
+            self.rows = [(json.loads(message),) for message in (messages[-limit:] if limit else messages)]
+            return
+        self.pool.gate.wait()
+        with self.pool.lock:
+            self.pool.statements += 1
+            self.pool.rows += [(params[index], params[index + 1]) for index in range(0, len(params), 2)]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self):
+        return FakeCursor(self.pool)
+
+
+class FakePool:
+    """Stands in for a psycopg pool: INSERTs append to `rows`, and wait for `gate` while it is cleared."""
+
+    def __init__(self, failing: bool = False):
+        self.failing = failing
+        self.rows = []
+        self.statements = 0
+        self.lock = threading.Lock()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    @contextmanager
+    def connection(self):
+        if self.failing:
+            raise ConnectionError('database is down')
+        yield FakeConnection(self)
+
+
+def turn(index):
+    return [Message('human', f'question {index}'), Message('ai', f'answer {index}')]
+
+
+def writer_for(pool, **kwargs):
+    return HistoryWriter(pool, serialize=serialize, **kwargs)
+
+
+def test_close_writes_the_queued_turns():
+    pool = FakePool()
+    writer = writer_for(pool, flush_interval=0.05)
+    for index in range(10):
+        writer.add('chat_history', 'session', turn(index))
+
+    writer.close()
+    assert len(pool.rows) == 20
+    assert [json.loads(message)['data']['content'] for _, message in pool.rows][:2] == ['question 0', 'answer 0']
+    assert writer.pending('chat_history', 'session') == []
+    with pytest.raises(HistoryQueueFull):
+        writer.add('chat_history', 'session', turn(10))
+
+
+def test_turns_queued_together_share_one_insert():
+    pool = FakePool()
+    pool.gate.clear()
+    writer = writer_for(pool, batch_size=200, flush_interval=0.05)
+    writer.add('chat_history', 'session', turn(0))
+    # The first batch is being written, the next turns queue up behind it
+    time.sleep(0.1)
+    for index in range(1, 11):
+        writer.add('chat_history', 'session', turn(index))
+    pool.gate.set()
+
+    writer.close()
+    assert len(pool.rows) == 22
+    assert pool.statements == 2
+
+
+def test_full_queue_blocks_then_raises():
+    pool = FakePool()
+    pool.gate.clear()
+    writer = writer_for(pool, max_queue=1, batch_size=1, flush_interval=0.01, enqueue_timeout=0.05)
+    writer.add('chat_history', 'session', turn(0))
+    time.sleep(0.05)
+    writer.add('chat_history', 'session', turn(1))
+
+    start = time.monotonic()
+    with pytest.raises(HistoryQueueFull):
+        writer.add('chat_history', 'session', turn(2))
+    assert time.monotonic() - start >= 0.05
+    assert writer.metrics()['queue_full'] == 1
+    assert len(writer.pending('chat_history', 'session')) == 4
+
+    pool.gate.set()
+    writer.close()
+    assert len(pool.rows) == 4
+
+
+def test_every_message_gets_an_id_before_it_is_queued():
+    pool = FakePool()
+    writer = writer_for(pool)
+    messages = turn(0)
+    messages[0].id = 'known'
+    writer.add('chat_history', 'session', messages)
+    writer.close()
+
+    ids = [json.loads(message)['data']['id'] for _, message in pool.rows]
+    assert ids[0] == 'known' and ids[1]
+
+
+def test_a_batch_failing_every_retry_is_dropped_and_logged_with_its_sessions(caplog):
+    writer = writer_for(FakePool(failing=True), retries=1, flush_interval=0.2)
+    writer.add('chat_history', 'session-a', turn(0))
+    writer.add('chat_history', 'session-b', turn(1))
+
+    with caplog.at_level(logging.WARNING, logger='penelope.history'):
+        writer.close()
+
+    assert writer.metrics()['dropped'] == 2
+    assert writer.metrics()['write_errors'] == 2
+    assert writer.pending('chat_history', 'session-a') == []
+    dropped = [record.getMessage() for record in caplog.records if record.levelno == logging.ERROR]
+    assert len(dropped) == 1
+    assert 'chat_history/session-a' in dropped[0] and 'chat_history/session-b' in dropped[0]
+
+
+def test_reads_include_queued_turns_once():
+    pytest.importorskip('langchain_core')
+    pytest.importorskip('psycopg')
+    from langchain_core.messages import AIMessage, HumanMessage
+    from history import PooledChatMessageHistory
+
+    pool = FakePool()
+    pool.gate.clear()
+    writer = HistoryWriter(pool, flush_interval=0.01)
+    history = PooledChatMessageHistory('chat_history', 'session', pool=pool, window=10, writer=writer)
+    history.add_messages([HumanMessage(content='question 0'), AIMessage(content='answer 0')])
+    assert [message.content for message in history.messages] == ['question 0', 'answer 0']
+
+    # Written but not yet untracked: the turn is in the table and still pending
+    untrack = writer._untrack
+    untracked = threading.Event()
+    writer._untrack = lambda batch: untracked.wait() or untrack(batch)
+    pool.gate.set()
+    time.sleep(0.05)
+    assert len(pool.rows) == 2
+    assert [message.content for message in history.messages] == ['question 0', 'answer 0']
+
+    untracked.set()
+    writer.close()
+    assert [message.content for message in history.messages] == ['question 0', 'answer 0']
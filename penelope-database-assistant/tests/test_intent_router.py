@@ -0,0 +1,90 @@
+import pytest
+
+from intent_router import HISTORICAL_PRICE, NEWS, TOKEN_DATA, TVL, IntentRouter, parse_date_period
+
+CHAINS = {
+    'arbitrum': {'name': 'Arbitrum', 'tokenSymbol': 'ARB', 'gecko_id': 'arbitrum', 'tvl': 1},
+    'arb': {'name': 'Arbitrum', 'tokenSymbol': 'ARB', 'gecko_id': 'arbitrum', 'tvl': 1},
+    'optimism': {'name': 'Optimism', 'tokenSymbol': 'OP', 'gecko_id': 'optimism', 'tvl': 1},
+}
+
+
+@pytest.fixture
+def router():
+    return IntentRouter(chain_lookup=CHAINS.get)
+
+
+@pytest.mark.parametrize('question, intent, tool_call', [
+    ("What's the price of Bitcoin today?", TOKEN_DATA, {'name': 'get_token_data', 'args': {'coin': 'bitcoin'}}),
+    ("what's eth's market cap", TOKEN_DATA, {'name': 'get_token_data', 'args': {'coin': 'ethereum'}}),
+    ("Compare SOL, AVAX and ETH by market cap and volume.", TOKEN_DATA,
+     {'name': 'get_bulk_token_data', 'args': {'coins': ['solana', 'avalanche-2', 'ethereum']}}),
+    ("What was bitcoin's price in May 2014?", HISTORICAL_PRICE,
+     {'name': 'get_historical_price', 'args': {'coin': 'bitcoin', 'start': '2014-05'}}),
+    ("What is the TVL of Arbitrum right now?", TVL, {'name': 'get_llama_chains', 'args': {'token_symbol': 'Arbitrum'}}),
+    ("TVL of Arbitrum and Optimism", TVL,
+     {'name': 'get_llama_chains_tvl', 'args': {'token_symbols': ['Arbitrum', 'Optimism']}}),
+    ("Give me the latest bitcoin news", NEWS, {'name': 'get_latest_bitcoin_news', 'args': {'token_name': 'bitcoin'}}),
+])
+def test_structured_questions_are_routed(router, question, intent, tool_call):
+    route = router.route(question)
+    assert route is not None
+    assert route.intent == intent
+    assert route.tool_calls == [tool_call]
+
+
+@pytest.mark.parametrize('question', [
+    "price of bitcoin cash",
+    "ethereum classic price",
+    "price of wrapped bitcoin",
+    "bitcoin sv market cap",
+])
+def test_known_name_inside_an_unknown_one_goes_to_the_llm(router, question):
+    assert router.classify(question).confidence < router.min_confidence
+    assert router.route(question) is None
+
+
+@pytest.mark.parametrize('question', [
+    "Why did the price of bitcoin drop?",
+    "What about its market cap?",
+    "What's the price of that memecoin everyone talks about?",
+    "Ethereum news",
+])
+def test_open_ended_contextual_or_unresolved_questions_go_to_the_llm(router, question):
+    assert router.route(question) is None
+
+
+def test_lowercase_ambiguous_symbols_are_not_coins(router):
+    assert router.entities("what is the link price near the top", router.resolve_coin) == []
+    assert router.entities("what is the LINK price", router.resolve_coin) == ['chainlink']
+
+
+def test_parse_date_period():
+    assert parse_date_period("bitcoin on 2021-03-04") == '2021-03-04'
+    assert parse_date_period("bitcoin on 4th March 2021") == '2021-03-04'
+    assert parse_date_period("bitcoin in May 2014") == '2014-05'
+    assert parse_date_period("bitcoin in 2017") == '2017'
+    assert parse_date_period("bitcoin today") is None
+
+
+def test_stats_count_routes_and_fallbacks(router):
+    router.route("BTC price")
+    router.route("Why is bitcoin up?")
+    router.record_fallback(2.0)
+    router.route("ETH price")
+
+    metrics = router.metrics()
+    assert metrics['routed'] == 2
+    assert metrics['fallback'] == 1
+    assert metrics['latency_saved_seconds'] == 2.0
+
+    # The route's tools failed, the LLM tool selection ran after all
+    router.record_fallback(2.0, failed_route=True)
+    metrics = router.metrics()
+    assert metrics['routed'] == 1
+    assert metrics['fallback'] == 2
+    assert metrics['failed_routes'] == 1
+
+
+def test_disabled_router_routes_nothing():
+    assert IntentRouter(enabled=False).route("BTC price") is None
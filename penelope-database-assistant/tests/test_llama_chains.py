@@ -0,0 +1,119 @@
+import pytest
+
+import llama_chains
+from llama_chains import LlamaChainsIndex
+from resilience import Upstream
+
+CHAINS = [
+    {'name': 'Ethereum', 'tokenSymbol': 'ETH', 'tvl': 50},
+    {'name': 'Arbitrum', 'tokenSymbol': 'ARB', 'tvl': 3},
+    {'name': 'Arbitrum Nova', 'tokenSymbol': 'ARB', 'tvl': 1},
+    {'name': 'Base', 'tokenSymbol': None, 'tvl': 2},
+]
+
+
+class Response:
+    def __init__(self, status_code, payload=None, etag=None):
+        self.status_code = status_code
+        self.payload = payload
+        self.headers = {'ETag': etag} if etag else {}
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    """Queue of responses served to `requests.get`, which records the headers it was sent."""
+    queue, sent = [], []
+
+    def get(url, headers=None, timeout=None):
+        sent.append((headers, timeout))
+        response = queue.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(llama_chains.requests, 'get', get)
+    return queue, sent
+
+
+def test_lookup_by_symbol_then_name_first_chain_wins():
+    index = LlamaChainsIndex()
+    index.load(CHAINS)
+
+    assert index.lookup('eth')['name'] == 'Ethereum'
+    assert index.lookup('ARB')['name'] == 'Arbitrum'
+    assert index.lookup('arbitrum nova')['tvl'] == 1
+    assert index.lookup('BASE')['name'] == 'Base'
+    assert index.lookup('doge') is None
+
+
+def test_bulk_tvl_reports_missing_symbols():
+    index = LlamaChainsIndex()
+    index.load(CHAINS)
+
+    assert index.bulk_tvl(['ETH', 'doge']) == {'ETH': {'name': 'Ethereum', 'tvl': 50}, 'doge': None}
+
+
+def test_refresh_sends_the_etag_and_keeps_the_snapshot_when_not_modified(responses):
+    queue, sent = responses
+    queue.extend([Response(200, CHAINS, etag='"v1"'), Response(304)])
+    index = LlamaChainsIndex(timeout=7)
+
+    assert index.refresh()
+    assert index.refresh()
+
+    assert sent == [({}, 7), ({'If-None-Match': '"v1"'}, 7)]
+    assert index.lookup('eth')['name'] == 'Ethereum'
+    assert index.metrics()['refreshes'] == 1
+    assert index.metrics()['not_modified'] == 1
+
+
+def test_failed_refresh_keeps_the_previous_snapshot(responses):
+    queue, _ = responses
+    queue.extend([Response(200, CHAINS), ConnectionError('down')])
+    index = LlamaChainsIndex()
+
+    assert index.refresh()
+    assert index.refresh()
+    assert index.lookup('eth') is not None
+    assert index.metrics()['refresh_errors'] == 1
+
+    empty = LlamaChainsIndex()
+    queue.append(Response(500))
+    assert not empty.refresh()
+
+
+def test_recent_refresh_by_another_caller_is_not_repeated(responses):
+    queue, sent = responses
+    queue.append(Response(200, CHAINS))
+    index = LlamaChainsIndex()
+
+    assert index.refresh(max_age=60)
+    assert index.refresh(max_age=60)
+    assert len(sent) == 1
+    assert index.metrics()['collapsed_refreshes'] == 1
+
+
+def test_download_goes_through_the_quota_and_the_upstream_policy(responses):
+    queue, sent = responses
+    queue.extend([Response(503), Response(200, CHAINS)])
+    quota = []
+
+    def rate_limit(timeout):
+        quota.append(timeout)
+        return timeout / 2
+
+    upstream = Upstream('defillama', timeout=4, retries=1, backoff=0.001)
+    index = LlamaChainsIndex(rate_limit=rate_limit, call=upstream.call)
+
+    assert index.refresh()
+    assert quota == [4, 4]
+    assert [timeout for _, timeout in sent] == [2, 2]
+    assert upstream.metrics()['retries'] == 1
+    assert index.lookup('arb')['name'] == 'Arbitrum'
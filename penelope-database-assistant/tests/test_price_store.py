@@ -0,0 +1,112 @@
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from price_store import PriceStore, parse_market_chart, parse_period
+
+
+def stamp(day: date) -> int:
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def chart(first: date, last: date, price=lambda day: float(day.day)):
+    days = [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+    return {
+        'prices': [[stamp(day), price(day)] for day in days],
+        'market_caps': [[stamp(day), price(day) * 10] for day in days],
+        'total_volumes': [[stamp(day), 1.0] for day in days],
+    }
+
+
+class MarketChart:
+    """`get_json` serving the daily chart from `first` to today, recording the requested `days`."""
+
+    def __init__(self, first: date, today: date, status: int = 200):
+        self.first = first
+        self.today = today
+        self.status = status
+        self.requests = []
+
+    def __call__(self, url, headers=None, params=None):
+        self.requests.append(params['days'])
+        if params['days'] == 'max':
+            start = self.first
+        else:
+            start = self.today - timedelta(days=int(params['days']))
+        return self.status, chart(start, self.today)
+
+
+@pytest.mark.parametrize('period, first, last', [
+    ('2024-02-10', date(2024, 2, 10), date(2024, 2, 10)),
+    ('2024-02', date(2024, 2, 1), date(2024, 2, 29)),
+    ('2023', date(2023, 1, 1), date(2023, 12, 31)),
+])
+def test_parse_period(period, first, last):
+    assert parse_period(period) == (first, last)
+
+
+def test_parse_period_rejects_invalid_dates():
+    with pytest.raises(ValueError):
+        parse_period('2024-13')
+
+
+def test_market_chart_rows_stop_at_the_last_complete_day():
+    rows = parse_market_chart(chart(date(2024, 1, 1), date(2024, 1, 3)), until=date(2024, 1, 2))
+
+    assert sorted(rows) == [date(2024, 1, 1), date(2024, 1, 2)]
+    assert rows[date(2024, 1, 2)] == {'date': date(2024, 1, 2), 'price': 2.0, 'market_cap': 20.0, 'total_volume': 1.0}
+
+
+def test_ingest_only_fetches_the_missing_days(tmp_path):
+    get_json = MarketChart(first=date(2024, 1, 1), today=date(2024, 1, 11))
+    store = PriceStore(str(tmp_path), get_json=get_json, base_url='https://coingecko')
+
+    assert store.ingest('bitcoin', today=date(2024, 1, 11)) == 10
+    assert store.ingest('bitcoin', today=date(2024, 1, 11)) == 0
+
+    get_json.today = date(2024, 1, 14)
+    assert store.ingest('bitcoin', today=date(2024, 1, 14)) == 3
+    assert get_json.requests == ['max', '4']
+    assert store.last_date('bitcoin') == date(2024, 1, 13)
+    assert store.coins() == ['bitcoin']
+
+
+def test_failed_ingest_raises_and_stores_nothing(tmp_path):
+    store = PriceStore(str(tmp_path), get_json=MarketChart(date(2024, 1, 1), date(2024, 1, 11), status=429), base_url='')
+
+    with pytest.raises(ValueError):
+        store.ingest('bitcoin', today=date(2024, 1, 11))
+    assert store.table('bitcoin') is None
+
+
+def test_price_on_and_price_range(tmp_path):
+    store = PriceStore(str(tmp_path), get_json=MarketChart(date(2024, 1, 1), date(2024, 2, 1)), base_url='')
+    store.ingest('bitcoin', today=date(2024, 2, 1))
+
+    assert store.price_on('bitcoin', date(2024, 1, 5)) == {
+        'date': '2024-01-05', 'price': 5.0, 'market_cap': 50.0, 'total_volume': 1.0,
+    }
+    assert store.price_on('bitcoin', date(2023, 1, 5)) is None
+    assert store.price_on('ethereum', date(2024, 1, 5)) is None
+
+    summary = store.price_range('bitcoin', *parse_period('2024-01'))
+    assert summary['days'] == 31
+    assert (summary['first_date'], summary['last_date']) == ('2024-01-01', '2024-01-31')
+    assert (summary['price_open'], summary['price_close']) == (1.0, 31.0)
+    assert (summary['price_min'], summary['price_max'], summary['price_avg']) == (1.0, 31.0, 16.0)
+    assert summary['market_cap_avg'] == 160.0
+    assert store.price_range('bitcoin', *parse_period('2023')) is None
+
+
+def test_parts_are_compacted_keeping_the_latest_row_of_each_day(tmp_path):
+    def rows(price, *days):
+        return [{'date': date(2024, 1, day), 'price': price, 'market_cap': None, 'total_volume': None} for day in days]
+
+    store = PriceStore(str(tmp_path), max_parts=2)
+    store.append('bitcoin', rows(1.0, 1, 2))
+    store.append('bitcoin', rows(2.0, 2, 3))
+    assert len(store._parts('bitcoin')) == 2
+
+    store.append('bitcoin', rows(3.0, 3))
+    assert len(store._parts('bitcoin')) == 1
+    assert [store.price_on('bitcoin', date(2024, 1, day))['price'] for day in (1, 2, 3)] == [1.0, 2.0, 3.0]
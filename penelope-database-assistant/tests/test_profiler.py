@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import threading
+import json
+import os
+import time
+
+import pytest
+
+from profiler import COLLAPSED, SPEEDSCOPE, Profiler, profile_file, profile_thread
+
+
+def spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def tool_work():
+    with profile_thread():
+        spin(0.05)
+
+
+def unrelated_work(stop):
+    while not stop.is_set():
+        spin(0.001)
+
+
+def wait_for_profile(profiler):
+    end = time.monotonic() + 2
+    while profiler.metrics()['running'] and time.monotonic() < end:
+        time.sleep(0.01)
+
+
+def test_only_the_request_and_its_tool_threads_are_sampled(tmp_path):
+    profiler = Profiler(str(tmp_path), enabled=True, interval=0.002)
+    stop = threading.Event()
+    unrelated = threading.Thread(target=unrelated_work, args=(stop,), name='unrelated')
+    unrelated.start()
+    tools = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tool')
+    try:
+        with profiler.profile({'X-Profile': '1'}, 'trace'):
+            # `submit_in_context` carries the request's context to the tool thread
+            tools.submit(contextvars.copy_context().run, tool_work).result()
+            spin(0.02)
+    finally:
+        stop.set()
+        unrelated.join()
+        tools.shutdown()
+    wait_for_profile(profiler)
+
+    path = os.path.join(str(tmp_path), profile_file.get())
+    threads = {line.split(';', 1)[0] for line in open(path)}
+    assert 'request' in threads
+    assert any(name.startswith('tool') for name in threads)
+    assert 'unrelated' not in threads
+    assert all('tool_work' in line for line in open(path) if line.startswith('tool'))
+
+
+def test_speedscope_profile_puts_the_request_first(tmp_path):
+    profiler = Profiler(str(tmp_path), enabled=True, interval=0.002)
+    with profiler.profile({'X-Profile': SPEEDSCOPE}):
+        spin(0.02)
+    wait_for_profile(profiler)
+
+    path = os.path.join(str(tmp_path), profile_file.get())
+    assert path.endswith('.speedscope.json')
+    profile = json.load(open(path))
+    assert profile['profiles'][0]['name'] == 'request'
+    assert profile['profiles'][0]['samples']
+
+
+def test_requests_are_profiled_on_demand_or_sampled():
+    profiler = Profiler('unused', enabled=True, fmt=COLLAPSED)
+    assert profiler.requested_format({'X-Profile': 'true'}) == COLLAPSED
+    assert profiler.requested_format({'X-Profile': 'speedscope'}) == SPEEDSCOPE
+    assert profiler.requested_format({}) is None
+    assert profiler.profile({}) is profiler.disabled
+    disabled = Profiler('unused')
+    assert disabled.profile({'X-Profile': '1'}) is disabled.disabled
+
+    with pytest.raises(ValueError):
+        Profiler('unused', fmt='pprof')
+
+
+def test_profiles_past_max_concurrent_are_skipped(tmp_path):
+    profiler = Profiler(str(tmp_path), enabled=True, max_concurrent=1)
+    with profiler.profile({'X-Profile': '1'}):
+        with profiler.profile({'X-Profile': '1'}):
+            pass
+    wait_for_profile(profiler)
+
+    assert profiler.metrics()['skipped'] == 1
+    assert profiler.metrics()['profiles'] == 1
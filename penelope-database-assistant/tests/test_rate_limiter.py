@@ -0,0 +1,77 @@
+import threading
+import asyncio
+import time
+
+import pytest
+
+from rate_limiter import BACKGROUND, INTERACTIVE, RateLimiter, RateLimitTimeout, TokenBucketStore, priority
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TokenBucketStore(str(tmp_path / 'rate_limits.sqlite3'))
+
+
+def test_burst_is_served_without_waiting(store):
+    limiter = RateLimiter('test', store, per_minute=60, burst=3, reserve=0)
+    assert [limiter.acquire(INTERACTIVE) < 0.05 for _ in range(3)] == [True] * 3
+
+
+def test_acquire_times_out_when_the_quota_stays_exhausted(store):
+    limiter = RateLimiter('test', store, per_minute=1, burst=1, reserve=0)
+    limiter.acquire(INTERACTIVE)
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(INTERACTIVE, timeout=0.05)
+    assert limiter.stats['timeouts'] == 1
+
+
+def test_background_requests_leave_the_reserve_to_interactive_ones(store):
+    limiter = RateLimiter('test', store, per_minute=1, burst=2, reserve=0.5)
+    limiter.acquire(BACKGROUND)
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(BACKGROUND, timeout=0.05)
+    assert limiter.acquire(INTERACTIVE, timeout=0.05) < 0.05
+
+
+def test_interactive_waiters_are_served_before_background_ones(store):
+    limiter = RateLimiter('test', store, per_minute=600, burst=1, reserve=0)
+    limiter.acquire(INTERACTIVE)
+    served = []
+
+    def wait(level, name):
+        limiter.acquire(level, timeout=5)
+        served.append(name)
+
+    background = threading.Thread(target=wait, args=(BACKGROUND, 'background'))
+    background.start()
+    # The background waiter is at the head of the queue, waiting for the bucket to refill
+    time.sleep(0.02)
+    interactive = threading.Thread(target=wait, args=(INTERACTIVE, 'interactive'))
+    interactive.start()
+    background.join()
+    interactive.join()
+
+    assert served == ['interactive', 'background']
+
+
+def test_limiters_on_the_same_store_share_the_quota(store):
+    # Another worker process opens the same file
+    other = RateLimiter('test', TokenBucketStore(store.path), per_minute=1, burst=2, reserve=0)
+    limiter = RateLimiter('test', store, per_minute=1, burst=2, reserve=0)
+    limiter.acquire(INTERACTIVE)
+    other.acquire(INTERACTIVE)
+
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(INTERACTIVE, timeout=0.05)
+    # Separate quotas are separate buckets
+    assert RateLimiter('other', store, per_minute=1, burst=1, reserve=0).acquire(INTERACTIVE, timeout=0.05) < 0.05
+
+
+def test_the_level_defaults_to_the_context_priority(store):
+    limiter = RateLimiter('test', store, per_minute=1, burst=2, reserve=0.5)
+    limiter.acquire()
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(timeout=0.05)
+    with priority(INTERACTIVE):
+        assert asyncio.run(limiter.aacquire(timeout=0.05)) < 0.05
+    assert limiter.metrics()['acquired'] == {'interactive': 1, 'background': 1}
@@ -0,0 +1,222 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import threading
+import time
+
+import pytest
+
+from resilience import (
+    CLOSED, HALF_OPEN, OPEN,
+    BlockingCallPool, CircuitBreaker, CircuitOpenError, DeadlineExceeded, Upstream, UpstreamBusy, UpstreamStatusError,
+    deadline, remaining,
+)
+
+
+class ApiError(Exception):
+    def __init__(self, http_status):
+        super().__init__(f"HTTP {http_status}")
+        self.http_status = http_status
+
+
+def fail_with(error):
+    def request(timeout):
+        raise error
+    return request
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.opened == 1
+
+
+def test_breaker_half_open_lets_a_single_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_breaker_failed_trial_opens_again():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.opened == 2
+
+
+def test_upstream_short_circuits_while_open():
+    upstream = Upstream('test', retries=0, failure_threshold=2, reset_timeout=30)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            upstream.call(fail_with(ConnectionError()))
+
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        upstream.call(lambda timeout: calls.append(timeout))
+    assert calls == []
+    assert upstream.metrics()['short_circuits'] == 1
+
+
+def test_upstream_retries_retryable_errors():
+    attempts = []
+
+    def request(timeout):
+        attempts.append(timeout)
+        if len(attempts) < 3:
+            raise UpstreamStatusError(503)
+        return 'ok'
+
+    upstream = Upstream('test', retries=2, backoff=0.001)
+    assert upstream.call(request) == 'ok'
+    assert len(attempts) == 3
+    assert upstream.metrics()['retries'] == 2
+    assert upstream.breaker.state == CLOSED
+
+
+def test_upstream_caller_errors_do_not_open_the_circuit():
+    upstream = Upstream('test', retries=0, failure_threshold=1)
+    with pytest.raises(ValueError):
+        upstream.call(fail_with(ValueError()))
+    assert upstream.breaker.state == CLOSED
+
+
+def open_then_half_open(upstream):
+    with pytest.raises(ConnectionError):
+        upstream.call(fail_with(ConnectionError()))
+    time.sleep(0.06)
+
+
+@pytest.mark.parametrize('error', [KeyError('price'), TypeError(), ApiError(503)])
+def test_upstream_local_errors_in_a_trial_do_not_close_the_circuit(error):
+    upstream = Upstream('test', retries=0, failure_threshold=1, reset_timeout=0.05)
+    open_then_half_open(upstream)
+
+    with pytest.raises(type(error)):
+        upstream.call(fail_with(error))
+    assert upstream.breaker.state == HALF_OPEN
+    # The trial gave no verdict, the next call is the new trial
+    assert upstream.call(lambda timeout: 'ok') == 'ok'
+    assert upstream.breaker.state == CLOSED
+
+
+def test_upstream_client_error_in_a_trial_closes_the_circuit():
+    upstream = Upstream('test', retries=0, failure_threshold=1, reset_timeout=0.05)
+    open_then_half_open(upstream)
+
+    with pytest.raises(ApiError):
+        upstream.call(fail_with(ApiError(404)))
+    assert upstream.breaker.state == CLOSED
+
+
+def test_upstream_classifier_opens_the_circuit_without_retrying():
+    attempts = []
+
+    def request(timeout):
+        attempts.append(timeout)
+        raise ApiError(500)
+
+    upstream = Upstream('test', retries=2, failure_threshold=1,
+                        is_failure=lambda error: getattr(error, 'http_status', 500) >= 500)
+    with pytest.raises(ApiError):
+        upstream.call(request)
+    assert len(attempts) == 1
+    assert upstream.breaker.state == OPEN
+
+    client_error = Upstream('test', retries=0, failure_threshold=1,
+                            is_failure=lambda error: getattr(error, 'http_status', 500) >= 500)
+    with pytest.raises(ApiError):
+        client_error.call(fail_with(ApiError(404)))
+    assert client_error.breaker.state == CLOSED
+
+
+def test_upstream_timeout_is_capped_by_the_deadline():
+    upstream = Upstream('test', timeout=10)
+    with deadline(0.5):
+        timeout = upstream.call(lambda timeout: timeout)
+        assert 0 < timeout <= 0.5
+        assert remaining() <= 0.5
+
+
+def test_upstream_gives_up_once_the_deadline_has_passed():
+    upstream = Upstream('test')
+    with deadline(0):
+        with pytest.raises(DeadlineExceeded):
+            upstream.call(lambda timeout: 'ok')
+
+
+def test_upstream_hedges_after_the_p95_latency():
+    executor = ThreadPoolExecutor(max_workers=4)
+    upstream = Upstream('test', timeout=2, hedge=True, executor=executor)
+    for _ in range(upstream.latency.min_samples):
+        upstream.latency.record(0.02)
+
+    calls = []
+    lock = threading.Lock()
+
+    def request(timeout):
+        with lock:
+            calls.append(timeout)
+            first = len(calls) == 1
+        if first:
+            time.sleep(1)
+            return 'primary'
+        return 'hedge'
+
+    start = time.monotonic()
+    assert upstream.call(request) == 'hedge'
+    assert time.monotonic() - start < 0.5
+    assert len(calls) == 2
+    metrics = upstream.metrics()
+    assert metrics['hedges'] == 1
+    assert metrics['hedge_wins'] == 1
+    executor.shutdown(wait=False)
+
+
+def test_upstream_does_not_hedge_without_latency_samples_or_idempotence():
+    executor = ThreadPoolExecutor(max_workers=4)
+    upstream = Upstream('test', timeout=2, hedge=True, executor=executor)
+    assert upstream.call(lambda timeout: 'ok') == 'ok'
+
+    for _ in range(upstream.latency.min_samples):
+        upstream.latency.record(0.001)
+    assert upstream.call(lambda timeout: time.sleep(0.05) or 'ok', idempotent=False) == 'ok'
+    assert upstream.metrics()['hedges'] == 0
+    executor.shutdown(wait=False)
+
+
+def test_blocking_call_pool_rejects_calls_once_too_many_are_abandoned():
+    calls = BlockingCallPool(4, max_abandoned=2, name='test')
+    hung = threading.Event()
+
+    for _ in range(2):
+        with pytest.raises(FutureTimeoutError):
+            calls.run(0.02, hung.wait)
+    with pytest.raises(UpstreamBusy):
+        calls.run(1, lambda: 'ok')
+    assert calls.metrics()['rejected'] == 1
+
+    hung.set()
+    deadline_at = time.monotonic() + 1
+    while calls.metrics()['running_abandoned'] and time.monotonic() < deadline_at:
+        time.sleep(0.01)
+    assert calls.run(1, lambda: 'ok') == 'ok'
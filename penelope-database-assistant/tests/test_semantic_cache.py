@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+import pytest
+
+from intent_router import IntentRouter
+from semantic_cache import MARKET, SemanticCache
+
+
+def same_vector(texts):
+    # Every question is a perfect paraphrase of every other, so only the key decides a hit
+    return np.ones((len(texts), 4), dtype=np.float32) / 2
+
+
+def cache(**kwargs):
+    kwargs.setdefault('subject', IntentRouter().subject)
+    return SemanticCache(embed=same_vector, maxsize=kwargs.pop('maxsize', 8), **kwargs)
+
+
+def test_paraphrase_about_the_same_coin_is_a_hit():
+    semantic = cache()
+    semantic.store("What's the price of ETH?", 'eth answer', 2.0)
+
+    value, _ = semantic.lookup("eth price right now")
+
+    assert value == 'eth answer'
+    assert semantic.metrics()['hits'] == 1
+
+
+@pytest.mark.parametrize('stored, asked', [
+    ("What's the price of ETH?", "What's the price of SOL?"),
+    ("price of bitcoin", "price of bitcoin cash"),
+    ("price of pepe", "price of bonk"),
+])
+def test_a_different_subject_is_a_miss(stored, asked):
+    semantic = cache()
+    semantic.store(stored, 'answer', 1.0)
+
+    value, vector = semantic.lookup(asked)
+
+    assert value is None
+    assert vector is not None
+
+
+def test_different_numbers_are_a_miss():
+    semantic = cache()
+    semantic.store("bitcoin price in May 2014", '2014 answer', 1.0)
+
+    assert semantic.lookup("bitcoin price in May 2015")[0] is None
+    assert semantic.lookup("bitcoin price in May 2014")[0] == '2014 answer'
+
+
+def test_different_intents_are_a_miss():
+    semantic = cache(subject=None)
+    semantic.store("What is a blockchain?", 'definition', 1.0)
+
+    assert semantic.lookup("blockchain price")[0] is None
+
+
+def test_contextual_questions_bypass_the_cache():
+    semantic = cache()
+    semantic.store("what is its price?", 'answer', 1.0)
+
+    assert semantic.lookup("what is its price?") == (None, None)
+    assert semantic.metrics()['bypassed'] == 1
+    assert semantic.metrics()['stores'] == 0
+
+
+def test_entries_expire_with_their_intent_ttl():
+    semantic = cache(intent_ttls={MARKET: 0.05})
+    semantic.store("price of ETH", 'answer', 1.0)
+    time.sleep(0.1)
+
+    assert semantic.lookup("price of ETH")[0] is None
+    assert semantic.metrics()['expirations'] == 1
+
+
+def test_least_recently_used_entry_is_evicted_when_full():
+    semantic = cache(maxsize=2)
+    semantic.store("price of ETH", 'eth', 1.0)
+    semantic.store("price of SOL", 'sol', 1.0)
+    semantic.lookup("price of ETH")
+    semantic.store("price of AVAX", 'avax', 1.0)
+
+    assert semantic.lookup("price of ETH")[0] == 'eth'
+    assert semantic.lookup("price of SOL")[0] is None
+    assert semantic.lookup("price of AVAX")[0] == 'avax'
+
+
+def test_disabled_cache_never_embeds():
+    def embed(texts):
+        raise AssertionError('embedded while disabled')
+
+    semantic = SemanticCache(embed=embed, enabled=False)
+    semantic.store("price of ETH", 'answer', 1.0)
+
+    assert semantic.lookup("price of ETH") == (None, None)
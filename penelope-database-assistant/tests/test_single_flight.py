@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import asyncio
+import time
+
+import pytest
+
+from single_flight import SingleFlight, request_key
+
+
+def test_request_key_ignores_parameter_order():
+    assert request_key('u', {'a': '1', 'b': '2'}, {'x': 1, 'y': 2}) == request_key('u', {'b': '2', 'a': '1'}, {'y': 2, 'x': 1})
+
+
+def fan_out(flight, fn, callers=8):
+    def call():
+        try:
+            return flight.do('key', fn)
+        except Exception as e:
+            return e
+
+    executor = ThreadPoolExecutor(max_workers=callers)
+    futures = [executor.submit(call) for _ in range(callers)]
+    # Every caller is waiting on the leader before it returns
+    while flight.stats['calls'] + flight.stats['collapsed'] < callers:
+        time.sleep(0.005)
+    executor.shutdown(wait=False)
+    return futures
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait()
+        return object()
+
+    futures = fan_out(flight, fn)
+    release.set()
+    results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.stats['collapsed'] == len(futures) - 1
+    assert flight.calls == {}
+
+
+def test_concurrent_calls_share_one_exception_and_the_next_call_runs_again():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait()
+        raise ValueError('upstream down')
+
+    futures = fan_out(flight, fn)
+    release.set()
+    errors = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert flight.stats['errors'] == 1
+
+    assert flight.do('key', lambda: 'recovered') == 'recovered'
+
+
+def test_async_calls_share_one_result_and_exception():
+    flight = SingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return 'value'
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        raise ValueError('upstream down')
+
+    async def main():
+        results = await asyncio.gather(*(flight.ado('key', fn) for _ in range(5)))
+        errors = await asyncio.gather(*(flight.ado('other', failing) for _ in range(5)), return_exceptions=True)
+        return results, errors
+
+    results, errors = asyncio.run(main())
+    assert results == ['value'] * 5
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert len(calls) == 2
+
+
+def test_a_waiter_does_not_inherit_a_finished_call():
+    flight = SingleFlight()
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.do('key', lambda: 2) == 2
+    assert flight.stats['collapsed'] == 0
+
+
+def test_a_cancelled_async_waiter_does_not_cancel_the_call():
+    flight = SingleFlight()
+
+    async def fn():
+        await asyncio.sleep(0.02)
+        return 'value'
+
+    async def main():
+        first = asyncio.ensure_future(flight.ado('key', fn))
+        second = asyncio.ensure_future(flight.ado('key', fn))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second, first.cancelled()
+
+    assert asyncio.run(main()) == ('value', True)
+    assert flight.metrics()['errors'] == 0
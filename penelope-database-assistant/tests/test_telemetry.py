@@ -0,0 +1,74 @@
+import json
+import logging
+
+import pytest
+
+from telemetry import Telemetry, incoming_trace_id, trace_id
+
+
+def test_trace_id_comes_from_traceparent_then_request_id_headers():
+    traceparent = '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01'
+    assert incoming_trace_id({'traceparent': traceparent}) == '4bf92f3577b34da6a3ce929d0e0e4736'
+    assert incoming_trace_id({'traceparent': 'garbage', 'X-Request-ID': 'abc'}) == 'abc'
+    assert len(incoming_trace_id({})) == 32
+
+
+def test_spans_are_timed_and_errors_counted():
+    telemetry = Telemetry()
+    with telemetry.span('tool_selection'):
+        pass
+    with pytest.raises(ValueError):
+        with telemetry.span('tool_selection'):
+            raise ValueError()
+
+    stage = telemetry.metrics()['tool_selection']
+    assert stage['count'] == 2
+    assert stage['errors'] == 1
+    assert stage['p50_ms'] is not None
+
+
+def test_disabled_telemetry_records_nothing():
+    telemetry = Telemetry(enabled=False)
+    with telemetry.span('answer'):
+        telemetry.increment('answers', outcome='cached')
+    assert telemetry.metrics() == {}
+    assert 'answers' not in telemetry.render()
+
+
+def test_render_exports_histograms_counters_and_collectors():
+    telemetry = Telemetry(buckets=(0.1, 1))
+    telemetry.observe('answer', 0.5)
+    telemetry.observe('answer', 2, error=True)
+    telemetry.increment('answers', outcome='cached')
+    telemetry.increment('answers', outcome='cached')
+    telemetry.register('cache', lambda: {'hits': 3, 'enabled': True, 'name': 'ignored', 'tiers': {'disk': 1}})
+    telemetry.register('upstream', lambda: {'coingecko': {'calls': 4}}, label='upstream')
+    telemetry.register('broken', lambda: 1 / 0)
+
+    lines = telemetry.render().splitlines()
+
+    assert 'penelope_stage_duration_seconds_bucket{stage="answer",le="0.1"} 0' in lines
+    assert 'penelope_stage_duration_seconds_bucket{stage="answer",le="1"} 1' in lines
+    assert 'penelope_stage_duration_seconds_bucket{stage="answer",le="+Inf"} 2' in lines
+    assert 'penelope_stage_duration_seconds_count{stage="answer"} 2' in lines
+    assert 'penelope_stage_errors_total{stage="answer"} 1' in lines
+    assert 'penelope_answers_total{outcome="cached"} 2' in lines
+    assert 'penelope_cache_hits 3' in lines
+    assert 'penelope_cache_enabled 1' in lines
+    assert 'penelope_cache_tiers_disk 1' in lines
+    assert 'penelope_upstream_calls{upstream="coingecko"} 4' in lines
+    assert not any('ignored' in line or 'broken' in line for line in lines)
+
+
+def test_trace_spans_are_logged_with_the_trace_id(caplog):
+    telemetry = Telemetry(trace_spans=True)
+    token = trace_id.set('trace-1')
+    try:
+        with caplog.at_level(logging.INFO, logger='penelope.trace'):
+            telemetry.observe('answer', 0.25)
+    finally:
+        trace_id.reset(token)
+
+    assert json.loads(caplog.records[-1].getMessage()) == {
+        'trace_id': 'trace-1', 'stage': 'answer', 'duration_ms': 250.0, 'error': False,
+    }
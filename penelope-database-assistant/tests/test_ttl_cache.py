@@ -0,0 +1,72 @@
+import time
+
+from ttl_cache import FRESH, MISS, STALE, REFRESH, TTLCache
+
+
+def wait_for(condition, timeout=1.0):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_miss_loads_and_caches():
+    cache = TTLCache()
+    loads = []
+    assert cache.get_or_load('key', lambda: loads.append(1) or 'value', ttl=60) == 'value'
+    assert cache.get_or_load('key', lambda: loads.append(1) or 'other', ttl=60) == 'value'
+    assert loads == [1]
+    assert cache.lookup('key')[1] == FRESH
+
+
+def test_failed_load_is_not_cached():
+    cache = TTLCache()
+    assert cache.get_or_load('key', lambda: None, ttl=60) is None
+    assert cache.lookup('key') == (None, MISS)
+
+
+def test_stale_entry_is_served_while_a_single_refresh_reloads_it():
+    cache = TTLCache()
+    cache.set('key', 'old', ttl=0.01, stale_ttl=60)
+    time.sleep(0.02)
+
+    loads = []
+
+    def loader():
+        loads.append(1)
+        time.sleep(0.05)
+        return 'new'
+
+    assert cache.get_or_load('key', loader, ttl=60, stale_ttl=60) == 'old'
+    assert cache.get_or_load('key', loader, ttl=60, stale_ttl=60) == 'old'
+    assert wait_for(lambda: cache.lookup('key') == ('new', FRESH))
+    assert loads == [1]
+
+
+def test_failed_refresh_keeps_the_stale_entry():
+    cache = TTLCache()
+    cache.set('key', 'old', ttl=0.01, stale_ttl=60)
+    time.sleep(0.02)
+
+    assert cache.get_or_load('key', lambda: None, ttl=60, stale_ttl=60) == 'old'
+    assert wait_for(lambda: 'key' not in cache.refreshing)
+    assert cache.lookup('key') == ('old', REFRESH)
+
+
+def test_lookup_claims_the_refresh_once():
+    cache = TTLCache()
+    cache.set('key', 'old', ttl=0.01, stale_ttl=60)
+    time.sleep(0.02)
+    assert cache.lookup('key') == ('old', REFRESH)
+    assert cache.lookup('key') == ('old', STALE)
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1, ttl=60)
+    cache.set('b', 2, ttl=60)
+    cache.get('a')
+    cache.set('c', 3, ttl=60)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats['evictions'] == 1